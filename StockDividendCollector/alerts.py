@@ -0,0 +1,192 @@
+"""
+Take-Profit / Cut-Loss alerts on price ticks.
+
+Every position's thresholds are turned into trigger prices once:
+  take-profit  price >= bought_price * (1 + high_rate_threshold / 100)
+  cut-loss     price <= bought_price * (1 + low_rate_threshold / 100)
+and kept per stock in sorted lists. A tick from the previous price to the new one
+bisects those lists for the trigger prices in between, so only the positions that
+actually cross a threshold are visited.
+
+A fired alert disarms its position until the price moves back past the trigger by
+the hysteresis margin, and an alert of the same kind for the same position is not
+repeated within the cooldown, so a price hovering at a threshold does not flap.
+"""
+
+import bisect
+import datetime
+import json
+import sys
+import time
+
+import requests
+
+TAKE_PROFIT = "take_profit"
+CUT_LOSS = "cut_loss"
+
+class Position:
+    """One holding watched for alerts; `armed` and `last_alert` are kept per alert kind."""
+
+    __slots__ = ("stock", "name", "portfolio", "bought_price", "low_rate_threshold", "high_rate_threshold",
+                 "armed", "last_alert")
+
+    def __init__(self, stock, name, portfolio, bought_price, low_rate_threshold, high_rate_threshold):
+        self.stock = stock
+        self.name = name
+        self.portfolio = portfolio
+        self.bought_price = bought_price
+        self.low_rate_threshold = low_rate_threshold
+        self.high_rate_threshold = high_rate_threshold
+        self.armed = {TAKE_PROFIT: True, CUT_LOSS: True}
+        self.last_alert = {TAKE_PROFIT: None, CUT_LOSS: None}
+
+class _Levels:
+    """Prices sorted ascending, each with the position it belongs to."""
+
+    def __init__(self):
+        self.prices = []
+        self.positions = []
+
+    def add(self, price, position):
+        index = bisect.bisect_right(self.prices, price)
+        self.prices.insert(index, price)
+        self.positions.insert(index, position)
+
+    def between(self, low, high, include_low, include_high):
+        """The positions whose price lies between low and high (None for unbounded)."""
+        start = 0
+        if low is not None:
+            start = (bisect.bisect_left if include_low else bisect.bisect_right)(self.prices, low)
+        end = len(self.prices)
+        if high is not None:
+            end = (bisect.bisect_right if include_high else bisect.bisect_left)(self.prices, high)
+        return [(self.prices[i], self.positions[i]) for i in range(start, end)]
+
+class _Book:
+    """The trigger and re-arm levels of all positions of one stock."""
+
+    def __init__(self):
+        self.last_price = None
+        self.levels = {
+            (TAKE_PROFIT, "trigger"): _Levels(), (TAKE_PROFIT, "rearm"): _Levels(),
+            (CUT_LOSS, "trigger"): _Levels(), (CUT_LOSS, "rearm"): _Levels(),
+        }
+
+class AlertEngine:
+    """
+    Watches positions for threshold crossings. tick() returns the alert events and
+    passes each to every emitter: a callable taking the event dict.
+    """
+
+    def __init__(self, cooldown=300, hysteresis_pct=1.0, emitters=None, clock=time.time):
+        self.cooldown = cooldown
+        self.hysteresis = hysteresis_pct / 100
+        self.emitters = list(emitters or [])
+        self.clock = clock
+        self._books = {}
+
+    def add_position(self, stock, bought_price, low_rate_threshold=None, high_rate_threshold=None, name=None, portfolio=None):
+        """Adds a position; without a bought price or any threshold it can never alert and is ignored."""
+        if not bought_price or bought_price <= 0 or (low_rate_threshold is None and high_rate_threshold is None):
+            return None
+
+        position = Position(stock, name, portfolio, bought_price, low_rate_threshold, high_rate_threshold)
+        book = self._books.setdefault(stock, _Book())
+        if high_rate_threshold is not None:
+            trigger = bought_price * (1 + high_rate_threshold / 100)
+            book.levels[TAKE_PROFIT, "trigger"].add(trigger, position)
+            book.levels[TAKE_PROFIT, "rearm"].add(trigger * (1 - self.hysteresis), position)
+        if low_rate_threshold is not None:
+            trigger = bought_price * (1 + low_rate_threshold / 100)
+            book.levels[CUT_LOSS, "trigger"].add(trigger, position)
+            book.levels[CUT_LOSS, "rearm"].add(trigger * (1 + self.hysteresis), position)
+        return position
+
+    def prime(self, stock, price):
+        """
+        Sets the starting price of a stock without alerting: positions already past a
+        trigger are disarmed, as their signal was part of the report.
+        """
+        book = self._books.get(stock)
+        if book is None or price is None:
+            return
+        for _, position in book.levels[TAKE_PROFIT, "trigger"].between(None, price, True, True):
+            position.armed[TAKE_PROFIT] = False
+        for _, position in book.levels[CUT_LOSS, "trigger"].between(price, None, True, True):
+            position.armed[CUT_LOSS] = False
+        book.last_price = price
+
+    def tick(self, stock, price, now=None):
+        """Processes a new price of a stock. Returns the alert events it caused."""
+        book = self._books.get(stock)
+        if book is None or price is None:
+            return []
+        now = self.clock() if now is None else now
+        previous, book.last_price = book.last_price, price
+        if previous == price:
+            return []
+
+        events = []
+        rising = previous is None or price > previous
+        falling = previous is None or price < previous
+        if rising:
+            # Take-profit triggers in (previous, price] are crossed; cut-loss re-arm levels in [previous, price) are left behind
+            for trigger, position in book.levels[TAKE_PROFIT, "trigger"].between(previous, price, False, True):
+                self._fire(events, position, TAKE_PROFIT, trigger, price, now)
+            if previous is not None:
+                for _, position in book.levels[CUT_LOSS, "rearm"].between(previous, price, True, False):
+                    position.armed[CUT_LOSS] = True
+        if falling:
+            for trigger, position in book.levels[CUT_LOSS, "trigger"].between(price, previous, True, False):
+                self._fire(events, position, CUT_LOSS, trigger, price, now)
+            if previous is not None:
+                for _, position in book.levels[TAKE_PROFIT, "rearm"].between(price, previous, False, True):
+                    position.armed[TAKE_PROFIT] = True
+
+        for event in events:
+            for emit in self.emitters:
+                emit(event)
+        return events
+
+    def _fire(self, events, position, kind, trigger, price, now):
+        if not position.armed[kind]:
+            return
+        position.armed[kind] = False # Until the price moves back past the hysteresis margin
+        last_alert = position.last_alert[kind]
+        if last_alert is not None and now - last_alert < self.cooldown:
+            return # Debounced
+        position.last_alert[kind] = now
+
+        threshold = position.high_rate_threshold if kind == TAKE_PROFIT else position.low_rate_threshold
+        events.append({
+            "type": "alert",
+            "kind": kind,
+            "stock": position.stock,
+            "name": position.name,
+            "portfolio": position.portfolio,
+            "price": price,
+            "trigger_price": round(trigger, 4),
+            "threshold": threshold,
+            "percent_pl": (price - position.bought_price) / position.bought_price * 100,
+            "time": datetime.datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+        })
+
+def print_alert(event, out=None):
+    """Emitter: one console line per alert."""
+    label = "Take-Profit" if event["kind"] == TAKE_PROFIT else "Cut-Loss"
+    portfolio = f" [{event['portfolio']}]" if event.get("portfolio") else ""
+    print(
+        f"[{event['time'][11:]}] ALERT {label}: {event['stock']} ({event['name']}){portfolio} "
+        f"{event['price']:.2f} crossed {event['trigger_price']:.2f} (P/L {event['percent_pl']:+.2f}%, threshold {event['threshold']:+g}%)",
+        file=out if out is not None else sys.stdout
+    )
+
+def webhook_emitter(url, timeout=5, log=print):
+    """Returns an emitter that POSTs every alert as JSON to url. Failures are logged, not raised."""
+    def emit(event):
+        try:
+            response = requests.post(url, data=json.dumps(event), headers={'Content-Type': 'application/json'}, timeout=timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            log(f"Alert webhook failed: {e}")
+    return emit
@@ -1,7 +1,21 @@
 from flask import Flask, render_template, request, jsonify
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import argparse
+import hashlib
+import queue
+import json
+import io
 import os
 import shlex
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import chatgpt_stock_dividend_collect as collector
+import instrumentation
+from job_queue import JobQueue
 
 app = Flask(__name__)
 
@@ -9,69 +23,599 @@ app = Flask(__name__)
 def index():
     return render_template('index.html')
 
+class ArgumentParseError(Exception):
+    pass
+
+class WebArgumentParser(argparse.ArgumentParser):
+    """Reports bad /run arguments to the caller instead of exiting the server."""
+    def error(self, message):
+        raise ArgumentParseError(f"{self.prog}: error: {message}")
+
+    def print_help(self, file=None):
+        raise ArgumentParseError(self.format_help())
+
+    def exit(self, status=0, message=None):
+        raise ArgumentParseError(message or "")
+
+# Collection runs execute in-process on a bounded number of workers instead of one interpreter
+# per click; identical runs that are still queued or running share a single execution
+JOB_QUEUE = JobQueue(
+    workers=int(os.environ.get("RUN_POOL_SIZE", 4)),
+    retention=int(os.environ.get("JOB_RETENTION", 300))
+)
+NDJSON = 'application/x-ndjson'
+
+# Watch streams live until the client disconnects, so they get their own pool and never starve /run
+WATCH_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("WATCH_POOL_SIZE", 8)))
+DEFAULT_WATCH_SECONDS = 60
+
+# All runs share one pooled HTTP client, so the rate limit holds across concurrent runs
+collector.configure_http_client(
+    pool_size=int(os.environ.get("YAHOO_POOL_SIZE", 16)),
+    retries=int(os.environ.get("YAHOO_RETRIES", 3)),
+    rate_limit=float(os.environ.get("YAHOO_RATE_LIMIT", 10)) or None,
+    max_delay=float(os.environ.get("YAHOO_MAX_RETRY_DELAY", 30))
+)
+
+class ResultCache:
+    """
+    Finished /run outputs keyed by what determines them. Entries expire after their TTL
+    and the least recently used ones are dropped beyond max_entries.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (expires_at, etag, body)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (etag, body) for a fresh entry, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, etag, body = entry
+            if time.time() > expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return etag, body
+
+    def put(self, key, body, ttl, etag=None):
+        """Stores body under key for ttl seconds; etag defaults to a hash of the body."""
+        etag = etag or hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+RESULT_CACHE = ResultCache(int(os.environ.get("RESULT_CACHE_SIZE", 64)))
+# Seconds a finished result is shared; set by the server, since --price-ttl is not part of the key
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 300))
+
+class PortfolioStore:
+    """
+    Uploaded portfolios, parsed once and keyed by their content hash, so identical uploads
+    from any user share one entry. The least recently used ones are dropped beyond max_entries.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # portfolio id -> collector.Portfolio
+        self._lock = threading.Lock()
+
+    def get(self, portfolio_id):
+        with self._lock:
+            portfolio = self._entries.get(portfolio_id)
+            if portfolio is not None:
+                self._entries.move_to_end(portfolio_id)
+            return portfolio
+
+    def add(self, content, name):
+        """Returns (Portfolio, True if it had to be parsed). Raises ValueError for an invalid file."""
+        portfolio_id = hashlib.sha256(content).hexdigest()
+        portfolio = self.get(portfolio_id)
+        if portfolio is not None:
+            return portfolio, False
+
+        portfolio = collector.parse_portfolio(content, name)
+        with self._lock:
+            self._entries[portfolio.id] = portfolio
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return portfolio, True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+PORTFOLIOS = PortfolioStore(int(os.environ.get("PORTFOLIO_STORE_SIZE", 256)))
+MAX_UPLOAD_BYTES = 1024 * 1024
+
+# Options that configure the server itself: requests get the server's settings
+SERVER_OPTIONS = {
+    "cache_dir": "--cache-dir",
+    "cache_max_mb": "--cache-max-mb",
+    "rate_limit": "--rate-limit",
+    "retries": "--retries",
+    "max_retry_delay": "--max-retry-delay",
+}
+MAX_RUN_WORKERS = int(os.environ.get("MAX_RUN_WORKERS", 16))
+# Hosts --alert-webhook may post to; none unless configured, so requests cannot aim the server at internal addresses
+ALERT_WEBHOOK_HOSTS = {host.strip().lower() for host in os.environ.get("ALERT_WEBHOOK_HOSTS", "").split(",") if host.strip()}
+
+def webhook_allowed(url):
+    target = urlparse(url)
+    return target.scheme in ('http', 'https') and (target.hostname or '').lower() in ALERT_WEBHOOK_HOSTS
+
+def parse_run_args(args_str, portfolio=None):
+    """
+    Parses /run arguments; with an uploaded portfolio, -i and -s are not needed (nor allowed).
+    Server settings (SERVER_OPTIONS), more than MAX_RUN_WORKERS workers and webhooks outside
+    ALERT_WEBHOOK_HOSTS are rejected.
+    """
+    # Use shlex to handle quotes correctly (posix=False preserves backslashes for Windows)
+    user_args = shlex.split(args_str, posix=False)
+    parser = collector.build_arg_parser(WebArgumentParser, input_required=portfolio is None)
+    parser.prog = 'chatgpt_stock_dividend_collect.py'
+    args = parser.parse_args(user_args)
+    for dest, option in SERVER_OPTIONS.items():
+        if getattr(args, dest) != parser.get_default(dest):
+            parser.error(f"argument {option}: set by the server, not allowed in a request")
+    if args.workers > MAX_RUN_WORKERS:
+        parser.error(f"argument -w/--workers: at most {MAX_RUN_WORKERS}")
+    if args.alert_webhook and not webhook_allowed(args.alert_webhook):
+        parser.error("argument --alert-webhook: host not allowed (see ALERT_WEBHOOK_HOSTS)")
+    if portfolio is not None:
+        if args.input_file or args.stocks:
+            parser.error("argument portfolio_id: not allowed with argument -i/--input-file or -s/--stocks")
+        args.portfolio = portfolio
+    return args
+
+def request_portfolio():
+    """
+    The uploaded portfolio named by the request's "portfolio_id", or None if there is none.
+    Raises KeyError for an id that is unknown (or was dropped): the file has to be uploaded again.
+    """
+    portfolio_id = request.json.get('portfolio_id')
+    if not portfolio_id:
+        return None
+    portfolio = PORTFOLIOS.get(portfolio_id)
+    if portfolio is None:
+        raise KeyError(portfolio_id)
+    return portfolio
+
+def unknown_portfolio_response(portfolio_id):
+    return jsonify({"status": "error", "message": f"Unknown portfolio {portfolio_id}, upload it again."}), 404
+
+def run_fingerprint(args, output_format, options):
+    """
+    Hashes the portfolio files' content (not their paths) together with the output format
+    and the given options. Returns None if an input file cannot be read.
+    """
+    digest = hashlib.sha256()
+    if args.portfolio is not None:
+        digest.update(args.portfolio.id.encode('utf-8')) # Already the hash of the content
+    for input_file in collector.expand_input_files(args.input_file or []):
+        try:
+            with open(input_file, 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            return None
+        digest.update(b"\0") # Keeps the boundary between files
+    digest.update(json.dumps([output_format, options], default=str).encode('utf-8')) # --total-return holds dates
+    return digest.hexdigest()
+
+def result_cache_key(args, output_format):
+    """
+    Keys a finished output by what determines it: the portfolio, the stock codes, the years
+    and the format. None when the run must not be cached (--no-cache or --refresh).
+    """
+    if args.no_cache or args.refresh:
+        return None
+    return run_fingerprint(args, output_format, [args.year, args.stocks, args.backtest, args.total_return])
+
+def job_key(args, output_format):
+    """Keys an execution by the portfolio and every option, so only identical runs are merged."""
+    options = sorted((name, value) for name, value in vars(args).items() if name not in ('input_file', 'portfolio'))
+    return run_fingerprint(args, output_format, options)
+
+def run_collection(args, log, on_row=None):
+    """Runs one collection with the CLI's options and returns the collect_dividends() (or household) result."""
+    cache = collector.open_cache(args)
+    try:
+        return collector.collect(args, cache, log=log, on_row=on_row)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def run_backtest(args, result, log):
+    """Backtests the thresholds of a finished collection with the CLI's options."""
+    cache = collector.open_cache(args)
+    try:
+        return collector.backtest_portfolio(result, args.workers, cache, log)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def run_total_return(args, result, log):
+    """Computes the --total-return periods of a finished collection with the CLI's options."""
+    periods = collector.total_return_periods(args.year, None if args.total_return is True else args.total_return)
+    cache = collector.open_cache(args)
+    try:
+        return collector.compute_total_returns(result, periods, args.workers, cache, log)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def text_job(args, emit):
+    """Emits the same console text, JSON block included, that the CLI prints. Returns the result."""
+    log = lambda message: emit(f"{message}\n")
+    result = run_collection(args, log=log)
+    if result:
+        out = io.StringIO()
+        collector.print_report(result, out)
+        if args.backtest:
+            collector.print_backtest_report(run_backtest(args, result, log), out)
+        if args.total_return:
+            collector.print_total_return_report(run_total_return(args, result, log), out)
+        emit(out.getvalue())
+    return result
+
+def caching_job(job, key, etag):
+    """
+    Wraps job(emit) so the complete output of a successful run is stored in RESULT_CACHE
+    for RESULT_CACHE_TTL seconds, under the etag its first response already announced.
+    """
+    def run(emit):
+        chunks = []
+
+        def record(message):
+            chunks.append(message)
+            emit(message)
+
+        result = job(record)
+        if result and key is not None:
+            RESULT_CACHE.put(key, "".join(chunks), RESULT_CACHE_TTL, etag)
+        return result
+    return run
+
+def cached_response(key, mimetype):
+    """
+    Serves a stored result, or None on a miss. A matching If-None-Match gets an
+    empty 304; POST responses are not cached by browsers, so the page sends it itself.
+    """
+    if key is None:
+        return None
+    hit = RESULT_CACHE.get(key)
+    if hit is None:
+        return None
+
+    etag, body = hit
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate, the prices move
+    return response
+
+def ndjson_job(args, emit):
+    """
+    Emits one JSON record per line: "log" records for console lines, a "stock" record
+    as soon as each stock is computed, and a final "summary" record with all rows in
+    input order, the portfolio totals and the text report. With --backtest a "backtest"
+    record with the trades of every year follows, and with --total-return a "total_return"
+    record with the holding returns of every period. Returns the result.
+    """
+    def emit_record(record):
+        emit(json.dumps(record) + "\n")
+
+    log = lambda message: emit_record({"type": "log", "message": message})
+    result = run_collection(args, log=log, on_row=lambda row: emit_record(dict(row, type="stock")))
+    if result:
+        out = io.StringIO()
+        collector.print_report(result, out, include_json=False)
+        summary = {
+            "type": "summary",
+            "period": result["year_label"],
+            "totals": result["totals"],
+            "rows": result["json_data"],
+            "report": out.getvalue()
+        }
+        if "portfolios" in result:
+            # Household runs: the rows and totals above combine these portfolios
+            summary["portfolios"] = [
+                {"name": portfolio["name"], "totals": portfolio["result"]["totals"], "rows": portfolio["result"]["json_data"]}
+                for portfolio in result["portfolios"]
+            ]
+        emit_record(summary)
+
+        if args.backtest:
+            backtest = run_backtest(args, result, log)
+            out = io.StringIO()
+            collector.print_backtest_report(backtest, out)
+            emit_record({
+                "type": "backtest",
+                "trades": [row for rows in backtest["rows"].values() for row in rows],
+                "totals": backtest["totals"],
+                "report": out.getvalue()
+            })
+
+        if args.total_return:
+            total_returns = run_total_return(args, result, log)
+            out = io.StringIO()
+            collector.print_total_return_report(total_returns, out)
+            emit_record({"type": "total_return", "periods": total_returns, "report": out.getvalue()})
+    return result
+
+def watch_job(args, emit, stop_event):
+    """
+    Runs ndjson_job() once, then re-polls only the latest prices until stop_event is set.
+    Every poll that moves a price emits a "stock" record per changed row and a "tick"
+    record with the updated totals, plus an "alert" record per Take-Profit/Cut-Loss crossing.
+    A "heartbeat" record follows every interval, polled or not: a disconnect is only noticed
+    when something is written, and a quiet stream would otherwise hold its WATCH_POOL thread.
+    """
+    def emit_record(record):
+        emit(json.dumps(record) + "\n")
+
+    result = ndjson_job(args, emit)
+    if not result:
+        return
+
+    def on_rows(rows):
+        for row in rows:
+            emit_record(dict(row, type="stock"))
+        emit_record({"type": "tick", "changed": [row["stock"] for row in rows], "totals": result["totals"]})
+
+    emitters = [emit_record]
+    if args.alert_webhook:
+        emitters.append(collector.webhook_emitter(args.alert_webhook, log=lambda message: emit_record({"type": "log", "message": message})))
+    alerts = collector.build_alert_engine(result, args.alert_cooldown, args.alert_hysteresis, emitters)
+
+    cache = collector.open_cache(args)
+    try:
+        collector.watch_prices(
+            result, args.watch or DEFAULT_WATCH_SECONDS, args.workers, cache,
+            log=lambda message: emit_record({"type": "log", "message": message}),
+            on_rows=on_rows,
+            stop_event=stop_event,
+            market_hours_only=not args.all_hours,
+            quote_batch=args.quote_batch,
+            alerts=alerts,
+            on_poll=lambda polled: emit_record({"type": "heartbeat", "polled": polled, "time": int(time.time())})
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+
+def stream_job(job, format_error, pool, stop_event=None):
+    """
+    Runs job(emit) on a pool and yields whatever it emits until it finishes.
+    stop_event, if given, is set when the client goes away so a long-lived job can end.
+    """
+    messages = queue.Queue()
+
+    def run():
+        try:
+            job(messages.put)
+        finally:
+            messages.put(None) # End of stream
+
+    future = pool.submit(run)
+
+    # Stream output as the run produces it
+    try:
+        while True:
+            message = messages.get()
+            if message is None:
+                break
+            yield message
+    finally:
+        if stop_event is not None:
+            stop_event.set()
+
+    error = future.exception()
+    if error is not None:
+        yield format_error(error)
+
+def format_run_error(output_format):
+    if output_format == 'ndjson':
+        return lambda error: json.dumps({"type": "error", "message": f"Run failed: {error}"}) + "\n"
+    return lambda error: f"\n[Run failed: {error}]"
+
+def job_response(job, start=0):
+    """Streams a job's output from chunk index start, with queue position notes while it waits."""
+    last_position = None
+
+    def queue_note():
+        nonlocal last_position
+        position = JOB_QUEUE.position(job)
+        if position == last_position or (position == 0 and last_position is None):
+            return None
+        last_position = position
+        if job.output_format == 'ndjson':
+            return json.dumps({"type": "job", "job_id": job.id, "status": job.status, "position": position}) + "\n"
+        return f"[Job {job.id} queued at position {position}]\n" if position else ""
+
+    def stream():
+        nonlocal last_position
+        if job.output_format == 'ndjson':
+            # Tell the client which job it follows, so it can reconnect to /jobs/<id>/stream
+            last_position = JOB_QUEUE.position(job)
+            yield json.dumps({"type": "job", "job_id": job.id, "status": job.status, "position": last_position}) + "\n"
+        yield from job.follow(start, on_wait=queue_note)
+
+    mimetype = NDJSON if job.output_format == 'ndjson' else 'text/plain'
+    response = app.response_class(stream(), mimetype=mimetype)
+    response.headers['X-Job-Id'] = job.id
+    if job.etag:
+        response.set_etag(job.etag)
+        response.headers['Cache-Control'] = 'no-cache' # Always revalidate, the prices move
+    return response
+
 @app.route('/run', methods=['POST'])
 def run_script():
     try:
         args_str = request.json.get('args', '')
-        print(f"DEBUG: Received request with args: {args_str}")
-        
-        # Base command
-        command = ['python', '-u', 'chatgpt_stock_dividend_collect.py'] # -u for unbuffered output
-        
-        # Use shlex to handle quotes correctly (posix=False preserves backslashes for Windows)
-        user_args = shlex.split(args_str, posix=False)
-        full_command = command + user_args
-        
-        cwd = os.getcwd()
-        print(f"DEBUG: Running in {cwd}")
-        print(f"DEBUG: Full command: {full_command}")
-
-        def generate():
-            # Use Popen for streaming
-            process = subprocess.Popen(
-                full_command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT, # Merge stderr into stdout
-                cwd=cwd,
-                text=False # We handle decoding manually
-            )
-
-            # Stream output
-            for line in iter(process.stdout.readline, b''):
-                try:
-                    # Try utf-8 then cp950 (Big5) then replace
-                    decoded_line = line.decode('utf-8')
-                except UnicodeDecodeError:
-                    try:
-                        decoded_line = line.decode('cp950')
-                    except:
-                        decoded_line = line.decode('utf-8', errors='replace')
-                
-                yield decoded_line
-
-            process.stdout.close()
-            return_code = process.wait()
-            
-            if return_code != 0:
-                yield f"\n[Process exited with error code {return_code}]"
-
-        return app.response_class(generate(), mimetype='text/plain')
+        output_format = request.json.get('format', 'text')
+        print(f"DEBUG: Received request with args: {args_str} (format: {output_format})")
+        try:
+            portfolio = request_portfolio()
+        except KeyError as e:
+            return unknown_portfolio_response(e.args[0])
+
+        if output_format == 'ndjson':
+            try:
+                args = parse_run_args(args_str, portfolio)
+            except ArgumentParseError as e:
+                record = json.dumps({"type": "error", "message": str(e)})
+                return app.response_class(f"{record}\n", mimetype=NDJSON)
+            job_function = ndjson_job
+            mimetype = NDJSON
+        else:
+            output_format = 'text'
+            try:
+                args = parse_run_args(args_str, portfolio)
+            except ArgumentParseError as e:
+                return app.response_class(f"{e}\n", mimetype='text/plain')
+            job_function = text_job
+            mimetype = 'text/plain'
+
+        key = result_cache_key(args, output_format)
+        response = cached_response(key, mimetype)
+        if response is not None:
+            instrumentation.increment("web_runs_total", served="result_cache")
+            return response
+
+        # The output is not known yet, so its validator is made up front and sent with the stream
+        etag = uuid.uuid4().hex if key is not None else None
+        job, created = JOB_QUEUE.submit(
+            job_key(args, output_format),
+            caching_job(lambda emit: job_function(args, emit), key, etag),
+            output_format,
+            format_run_error(output_format),
+            etag
+        )
+        instrumentation.increment("web_runs_total", served="new_job" if created else "joined_job")
+        if not created:
+            print(f"DEBUG: Joined in-flight job {job.id}")
+        return job_response(job)
 
     except Exception as e:
         return jsonify({'output': f"Server Error: {str(e)}", 'status': 'error'})
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown or expired job"}), 404
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "position": JOB_QUEUE.position(job),
+        "chunks": len(job.chunks)
+    })
+
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+def job_stream(job_id):
+    """Reconnects to a job's output; ?from=N skips the first N chunks already received."""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown or expired job"}), 404
+    return job_response(job, start=request.args.get('from', 0, type=int))
+
+@app.route('/watch', methods=['POST'])
+def watch_script():
+    """
+    Long-lived NDJSON stream: the same records as /run, then price-only updates
+    every --watch seconds (default 60) for as long as the client stays connected.
+    """
+    try:
+        portfolio = request_portfolio()
+    except KeyError as e:
+        return unknown_portfolio_response(e.args[0])
+    try:
+        args = parse_run_args(request.json.get('args', ''), portfolio)
+    except ArgumentParseError as e:
+        record = json.dumps({"type": "error", "message": str(e)})
+        return app.response_class(f"{record}\n", mimetype=NDJSON)
+
+    stop_event = threading.Event()
+    stream = stream_job(
+        lambda emit: watch_job(args, emit, stop_event),
+        lambda error: json.dumps({"type": "error", "message": f"Watch failed: {error}"}) + "\n",
+        pool=WATCH_POOL,
+        stop_event=stop_event
+    )
+    return app.response_class(stream, mimetype=NDJSON)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Counters and timings of all runs served by this process, in the Prometheus text format."""
+    waiting, in_flight = JOB_QUEUE.counts()
+    instrumentation.set_gauge("jobs_waiting", waiting)
+    instrumentation.set_gauge("jobs_in_flight", in_flight)
+    instrumentation.set_gauge("result_cache_entries", len(RESULT_CACHE))
+    instrumentation.set_gauge("portfolio_store_entries", len(PORTFOLIOS))
+    return app.response_class(instrumentation.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stocks/search', methods=['GET'])
+def search_stocks():
+    """Looks up stock codes by prefix or names by substring in the master name index."""
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    names = collector.open_master_names()
+    if not query or names is None:
+        return jsonify({"status": "success", "results": []})
+    results = [{"code": code, "name": name} for code, name in names.search(query, limit)]
+    return jsonify({"status": "success", "results": results})
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    """
+    Parses an uploaded portfolio file once and keeps it in memory under its content hash.
+    The returned portfolio_id is passed to /run and /watch instead of -i; uploading the
+    same content again, from any user, reuses the parsed portfolio.
+    """
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file part"}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({"status": "error", "message": "No selected file"}), 400
-    if file:
-        filename = file.filename
-        filepath = os.path.join(os.getcwd(), filename)
-        file.save(filepath)
-        return jsonify({"status": "success", "filepath": os.path.abspath(filepath)})
+
+    content = file.read(MAX_UPLOAD_BYTES + 1)
+    if len(content) > MAX_UPLOAD_BYTES:
+        return jsonify({"status": "error", "message": f"Portfolio file is larger than {MAX_UPLOAD_BYTES // 1024} KB"}), 413
+    try:
+        portfolio, parsed = PORTFOLIOS.add(content, os.path.basename(file.filename))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    instrumentation.increment("portfolio_uploads_total", result="parsed" if parsed else "known")
+    return jsonify(portfolio_summary(portfolio))
+
+@app.route('/portfolios/<portfolio_id>', methods=['GET'])
+def portfolio_status(portfolio_id):
+    """Whether an uploaded portfolio is still held, so the page can skip uploading it again."""
+    portfolio = PORTFOLIOS.get(portfolio_id)
+    if portfolio is None:
+        return unknown_portfolio_response(portfolio_id)
+    return jsonify(portfolio_summary(portfolio))
+
+def portfolio_summary(portfolio):
+    return {
+        "status": "success",
+        "portfolio_id": portfolio.id,
+        "name": portfolio.name,
+        "stocks": len(portfolio.positions),
+        "warnings": list(portfolio.warnings)
+    }
 
 # --- NEW EDITOR API ENDPOINTS REMOVED (Replaced by Browser Downloads) ---
 
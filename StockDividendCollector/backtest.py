@@ -0,0 +1,93 @@
+"""
+Backtest of the Take-Profit / Cut-Loss thresholds over daily history.
+
+The daily closes of all stocks are laid out as one matrix, a row per stock and a column
+per trading day (NaN where a stock has no close), next to a matrix of the cash dividends
+per share that go ex on each day. Every position buys at the first close of each year and
+sells at the first later close that reaches its take-profit or cut-loss price, or else at
+the last close of the year. Only the years are looped over: the closes of all positions
+in a year are compared with their trigger prices at once.
+"""
+
+import datetime
+
+import numpy as np
+
+# Outcome codes of a trade
+HELD = 0        # Held to the last close of the year
+TAKE_PROFIT = 1
+CUT_LOSS = 2
+NO_DATA = 3     # The stock has no close in the year
+
+OUTCOME_LABELS = {HELD: "Year-End", TAKE_PROFIT: "Take-Profit", CUT_LOSS: "Cut-Loss", NO_DATA: "No Data"}
+
+def simulate(closes, dividends, stock_rows, low_rate_thresholds, high_rate_thresholds):
+    """
+    Simulates one holding period for every position at once. closes and dividends hold the
+    period's columns; stock_rows gives each position's row in them, and the thresholds are
+    percentages with NaN for none.
+    Returns a dict of per-position arrays: "entry" and "exit" (column indexes), "entry_price",
+    "exit_price", "dividends" (per share, ex after the entry day up to the exit day) and "outcome".
+    """
+    count = len(stock_rows)
+    if closes.shape[1] == 0:
+        return {
+            "entry": np.zeros(count, dtype=int), "exit": np.zeros(count, dtype=int),
+            "entry_price": np.full(count, np.nan), "exit_price": np.full(count, np.nan),
+            "dividends": np.zeros(count), "outcome": np.full(count, NO_DATA)
+        }
+
+    traded = ~np.isnan(closes)
+    first = np.argmax(traded, axis=1)
+    last = closes.shape[1] - 1 - np.argmax(traded[:, ::-1], axis=1)
+    cumulative_dividends = np.cumsum(dividends, axis=1)
+
+    positions = np.arange(count)
+    position_closes = closes[stock_rows]
+    entry = first[stock_rows]
+    entry_price = position_closes[positions, entry]
+
+    # Comparisons with NaN are False: days without a close and missing thresholds never trigger
+    take_profit = position_closes >= (entry_price * (1 + high_rate_thresholds / 100))[:, None]
+    cut_loss = position_closes <= (entry_price * (1 + low_rate_thresholds / 100))[:, None]
+    hit = (take_profit | cut_loss) & (np.arange(closes.shape[1]) > entry[:, None])
+
+    triggered = hit.any(axis=1)
+    exit = np.where(triggered, np.argmax(hit, axis=1), last[stock_rows])
+    outcome = np.where(triggered, np.where(take_profit[positions, exit], TAKE_PROFIT, CUT_LOSS), HELD)
+    outcome = np.where(traded[stock_rows].any(axis=1), outcome, NO_DATA)
+
+    return {
+        "entry": entry,
+        "exit": exit,
+        "entry_price": entry_price,
+        "exit_price": position_closes[positions, exit],
+        "dividends": cumulative_dividends[stock_rows, exit] - cumulative_dividends[stock_rows, entry],
+        "outcome": outcome
+    }
+
+def run_backtest(days, closes, dividends, stock_rows, low_rate_thresholds, high_rate_thresholds, years):
+    """
+    Runs simulate() for each year on the matrices of price_store.build_history_matrix().
+    Returns {year: simulate() result plus "entry_day" and "exit_day" lists of datetime.date,
+    None for positions without a close in the year}.
+    """
+    stock_rows = np.asarray(stock_rows, dtype=int)
+    low_rate_thresholds = np.asarray(low_rate_thresholds, dtype=float)
+    high_rate_thresholds = np.asarray(high_rate_thresholds, dtype=float)
+
+    results = {}
+    for year in years:
+        start = int(np.searchsorted(days, datetime.date(year, 1, 1).toordinal(), 'left'))
+        end = int(np.searchsorted(days, datetime.date(year, 12, 31).toordinal(), 'right'))
+        trades = simulate(closes[:, start:end], dividends[:, start:end], stock_rows, low_rate_thresholds, high_rate_thresholds)
+
+        year_days = days[start:end].tolist()
+        has_data = (trades["outcome"] != NO_DATA).tolist()
+        for key in ("entry", "exit"):
+            trades[f"{key}_day"] = [
+                datetime.date.fromordinal(year_days[column]) if valid else None
+                for column, valid in zip(trades[key].tolist(), has_data)
+            ]
+        results[year] = trades
+    return results
@@ -0,0 +1,297 @@
+"""
+Benchmarks the collector against the local Yahoo stand-in (fake_yahoo.py).
+
+Every scenario runs in a fresh interpreter so its peak RSS is its own:
+  cli  collector.main() with a generated portfolio file, report included
+  web  POST /run (NDJSON) through the Flask app
+  quotes  latest prices only, batched (--quote-batch symbols per spark request)
+Results are appended to benchmark_results.jsonl and compared with the previous
+run of the same scenario and settings, so regressions stand out.
+--check-quote-fallback instead checks that batched quotes fall back to one chart
+request for exactly the symbols a spark answer lacks, and for all of a failed batch.
+
+  python benchmark.py                       # 10, 100 and 1000 symbols, both modes
+  python benchmark.py --sizes 100 --modes cli --latency 0.2 --error-rate 0.05
+  python benchmark.py --sizes 300 --modes quotes --quote-batch 1   # per-symbol baseline
+  python benchmark.py --check-quote-fallback
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import fake_yahoo
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+RESULTS_FILE = os.path.join(SCRIPT_DIR, 'benchmark_results.jsonl')
+
+def symbol_name(index):
+    return f"B{index:04d}.TW"
+
+def write_portfolio(path, symbols):
+    """Writes a portfolio file of `symbols` synthetic stocks with shares, bought price and thresholds."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for index in range(symbols):
+            f.write(f"Bench{index:04d} {symbol_name(index)} {1000 + index} {50 + index % 200}.5 30 -10\n")
+
+def warm_stand_in(fake, symbols):
+    """
+    Renders the stand-in's full and one-day payloads of the portfolio's symbols ahead of a
+    run. The stand-in shares the benchmark's interpreter, so rendering them inside the run
+    would bill the first scenario for it.
+    """
+    for index in range(symbols):
+        fake.payload(symbol_name(index), "max", "div", None, None)
+        fake.payload(symbol_name(index), "1d", "")
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError: # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def stage_timings():
+    """Seconds per stage from the collector's own instrumentation, summed over all threads."""
+    import instrumentation
+
+    _, timings, _ = instrumentation.snapshot()
+    stages = {}
+    for (name, labels), (_, seconds) in timings.items():
+        stage = dict(labels).get("stage", name.replace("_seconds", ""))
+        stages[stage] = round(seconds, 4)
+    return stages
+
+def run_child(options):
+    """Runs one scenario in this process and prints its measurements as one JSON line."""
+    import chatgpt_stock_dividend_collect as collector
+
+    cli_args = ['-y', options.year, '-i', options.portfolio, '--no-cache', '-w', str(options.workers),
+                '--quote-batch', str(options.quote_batch)]
+
+    started = time.perf_counter()
+    if options.child == 'quotes':
+        from concurrent.futures import ThreadPoolExecutor
+
+        collector.configure_http_client(pool_size=max(1, options.workers), rate_limit=options.rate_limit or None)
+        with open(options.portfolio, 'r', encoding='utf-8') as f:
+            stock_codes = [position[0] for position in collector.iter_portfolio(f)]
+        with ThreadPoolExecutor(max_workers=max(1, options.workers)) as executor:
+            quotes = collector.fetch_quotes_yahoo(stock_codes, batch_size=options.quote_batch, executor=executor)
+        if any(quote is None for quote in quotes.values()):
+            raise SystemExit("Some quotes could not be fetched")
+    elif options.child == 'cli':
+        args = collector.build_arg_parser().parse_args(cli_args + ['--rate-limit', str(options.rate_limit)])
+        with redirect_stdout(io.StringIO()):
+            collector.main(args)
+    else:
+        # The web app refuses --rate-limit in a request; it reads YAHOO_RATE_LIMIT instead
+        import app
+        client = app.app.test_client()
+        response = client.post('/run', json={'args': ' '.join(cli_args), 'format': 'ndjson'})
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        if not records or records[-1].get("type") != "summary":
+            raise SystemExit(f"/run did not finish: {records[-1] if records else 'no output'}")
+    wall = time.perf_counter() - started
+
+    print(json.dumps({"wall_s": round(wall, 3), "peak_rss_mb": peak_rss_mb(), "stages": stage_timings()}))
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_previous_results():
+    if not os.path.exists(RESULTS_FILE):
+        return []
+    with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def find_regressions(entry, previous, tolerance):
+    """Compares an entry with the last recorded run of the same scenario and settings."""
+    matches = [
+        old for old in previous
+        if old["mode"] == entry["mode"] and old["symbols"] == entry["symbols"] and old["settings"] == entry["settings"]
+    ]
+    if not matches:
+        return []
+
+    last = matches[-1]
+    regressions = []
+    for metric in ("wall_s", "requests_per_symbol", "peak_rss_mb"):
+        old_value, new_value = last.get(metric), entry.get(metric)
+        if old_value and new_value and new_value > old_value * (1 + tolerance):
+            regressions.append(f"{metric} {old_value} -> {new_value} (vs {last.get('commit') or 'previous run'})")
+    return regressions
+
+def run_scenario(mode, symbols, options, server, fake, work_dir):
+    portfolio = os.path.join(work_dir, f"portfolio_{symbols}.txt")
+    write_portfolio(portfolio, symbols)
+    warm_stand_in(fake, symbols)
+
+    env = dict(os.environ)
+    env.update({
+        "YAHOO_BASE_URL": f"http://127.0.0.1:{server.server_port}",
+        "YAHOO_RATE_LIMIT": str(options.rate_limit), # read by app.py
+        "YAHOO_POOL_SIZE": str(options.workers),
+        "RUN_POOL_SIZE": "1",
+    })
+    command = [
+        sys.executable, os.path.realpath(__file__), '--child', mode, '--portfolio', portfolio,
+        '--year', options.year, '--workers', str(options.workers), '--rate-limit', str(options.rate_limit),
+        '--quote-batch', str(options.quote_batch)
+    ]
+
+    before = fake.stats()
+    completed = subprocess.run(command, cwd=SCRIPT_DIR, env=env, capture_output=True, text=True)
+    after = fake.stats()
+    if completed.returncode != 0:
+        raise RuntimeError(f"{mode}/{symbols} failed:\n{completed.stderr or completed.stdout}")
+
+    measured = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        "mode": mode,
+        "symbols": symbols,
+        "wall_s": measured["wall_s"],
+        "requests_per_symbol": round((after["requests"] - before["requests"]) / symbols, 3),
+        "errors_injected": after["errors"] - before["errors"],
+        "peak_rss_mb": measured["peak_rss_mb"],
+        "stages": measured["stages"],
+    }
+
+def check_quote_fallback(options):
+    """
+    Runs fetch_quotes_yahoo() against a stand-in whose spark answers leave out a fifth of
+    the symbols, then against one whose spark requests all fail. Returns a list of failures.
+    """
+    server, fake = fake_yahoo.start_server(spark_drop_rate=0.2)
+    os.environ["YAHOO_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    import chatgpt_stock_dividend_collect as collector
+
+    retries = 2
+    collector.configure_http_client(pool_size=max(1, options.workers), retries=retries, backoff=0)
+    stock_codes = [symbol_name(index) for index in range(max(options.sizes))]
+    batches = -(-len(stock_codes) // options.quote_batch)
+    scenarios = [
+        ("dropped", {}, [code for code in stock_codes if fake.drops_from_spark(code)], batches),
+        ("failed", {"spark_drop_rate": 0.0, "spark_fail_status": 503}, stock_codes, batches * (1 + retries)),
+    ]
+
+    failures = []
+    for name, settings, expected_fallback, expected_spark in scenarios:
+        for key, value in settings.items():
+            setattr(fake, key, value)
+        before = fake.stats()
+        fake.chart_symbols.clear()
+        quotes = collector.fetch_quotes_yahoo(stock_codes, log=lambda message: None, batch_size=options.quote_batch)
+        spark_requests = fake.stats()["spark_requests"] - before["spark_requests"]
+
+        if sorted(quotes) != sorted(stock_codes) or any(quotes[code] is None for code in stock_codes):
+            failures.append(f"{name}: not every symbol got a quote")
+        if sorted(fake.chart_symbols) != sorted(expected_fallback):
+            failures.append(f"{name}: fell back for {len(fake.chart_symbols)} symbols, expected {len(expected_fallback)}")
+        if spark_requests != expected_spark:
+            failures.append(f"{name}: {spark_requests} spark requests, expected {expected_spark}")
+        print(f"{name:<8} {len(stock_codes)} symbols: {spark_requests} spark + {len(fake.chart_symbols)} chart requests", file=sys.stderr)
+    server.shutdown()
+    return failures
+
+def print_table(entries):
+    stages = sorted({stage for entry in entries for stage in entry["stages"]})
+    header = f"{'mode':<6} {'symbols':>7} {'wall_s':>8} {'req/sym':>8} {'rss_mb':>7}" + ''.join(f" {stage:>10}" for stage in stages)
+    print(header)
+    print("-" * len(header))
+    for entry in entries:
+        line = (
+            f"{entry['mode']:<6} {entry['symbols']:>7} {entry['wall_s']:>8.3f} "
+            f"{entry['requests_per_symbol']:>8.3f} {entry['peak_rss_mb'] if entry['peak_rss_mb'] is not None else '-':>7}"
+        )
+        line += ''.join(f" {entry['stages'].get(stage, 0.0):>10.3f}" for stage in stages)
+        print(line)
+    print("Stage columns are seconds summed over all worker threads.")
+
+def main(options):
+    settings = {
+        "latency": options.latency, "error_rate": options.error_rate, "years": options.history_years,
+        "workers": options.workers, "rate_limit": options.rate_limit, "year": options.year,
+    }
+    server, fake = fake_yahoo.start_server(
+        latency=options.latency, error_rate=options.error_rate,
+        years=options.history_years, recorded_dir=options.recorded_dir
+    )
+    previous = load_previous_results()
+    commit = git_commit()
+    timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+
+    entries = []
+    regressions = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for mode in options.modes:
+            for symbols in options.sizes:
+                print(f"Running {mode} with {symbols} symbols...", file=sys.stderr)
+                entry = run_scenario(mode, symbols, options, server, fake, work_dir)
+                # The batch size only matters for the quotes mode; the others keep comparing with older runs
+                entry_settings = dict(settings, quote_batch=options.quote_batch) if mode == 'quotes' else settings
+                entry.update({"timestamp": timestamp, "commit": commit, "python": sys.version.split()[0], "settings": entry_settings})
+                entries.append(entry)
+                regressions += [f"{mode}/{symbols}: {message}" for message in find_regressions(entry, previous, options.tolerance)]
+    server.shutdown()
+
+    print_table(entries)
+    if not options.no_record:
+        with open(RESULTS_FILE, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    if regressions:
+        print(f"\nRegressions beyond {options.tolerance:.0%}:")
+        for message in regressions:
+            print(f"  {message}")
+        if options.fail_on_regression:
+            sys.exit(1)
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the collector against a local Yahoo chart stand-in.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help="Portfolio sizes to run (default: 10 100 1000)")
+    parser.add_argument('--modes', nargs='+', choices=['cli', 'web', 'quotes'], default=['cli', 'web'])
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the stand-in waits per request (default: 0.05)")
+    parser.add_argument('--error-rate', type=float, default=0.01, help="Fraction of requests answered with 429 (default: 0.01)")
+    parser.add_argument('--history-years', type=int, default=10, help="History length of the synthetic charts (default: 10)")
+    parser.add_argument('--recorded-dir', help="Serve recorded <SYMBOL>.json payloads from this directory when present")
+    parser.add_argument('--year', default=str(datetime.date.today().year - 1), help="The -y argument of every run (default: last year)")
+    parser.add_argument('-w', '--workers', type=int, default=8)
+    parser.add_argument('--rate-limit', type=float, default=0, help="Collector rate limit in requests/s (default: 0, unlimited)")
+    parser.add_argument('--quote-batch', type=int, default=20, help="Symbols per batched quote request (default: 20, 1 for per-symbol)")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Growth over the previous run reported as a regression (default: 0.2)")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 when a regression is found")
+    parser.add_argument('--no-record', action='store_true', help=f"Do not append to {os.path.basename(RESULTS_FILE)}")
+    parser.add_argument('--check-quote-fallback', action='store_true',
+                        help="Check the per-symbol fallback of batched quotes (largest --sizes symbols) instead of benchmarking")
+    parser.add_argument('--child', choices=['cli', 'web', 'quotes'], help=argparse.SUPPRESS)
+    parser.add_argument('--portfolio', help=argparse.SUPPRESS)
+    return parser
+
+if __name__ == "__main__":
+    options = build_arg_parser().parse_args()
+    if options.child:
+        run_child(options)
+    elif options.check_quote_fallback:
+        failures = check_quote_fallback(options)
+        for failure in failures:
+            print(f"FAILED {failure}")
+        sys.exit(1 if failures else 0)
+    else:
+        main(options)
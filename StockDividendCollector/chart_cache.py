@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+import time
+import json
+import os
+
+import instrumentation
+from price_store import open_price_store
+
+# Seconds an entry of each kind stays fresh; None keeps it until it is evicted.
+DEFAULT_TTLS = {
+    "history": None,       # year buckets; the running year is extended by incremental syncs
+    "quote": 300,          # regularMarketPrice / regularMarketTime
+}
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'stock_dividend_collector')
+
+class ChartCache:
+    """
+    A small SQLite key/value cache for data parsed from Yahoo chart responses.
+    Every entry has a kind that selects its TTL. When the stored values grow past
+    max_bytes, the least recently used entries are evicted. The daily closes are
+    kept separately in `prices`, a PriceStore beside the cache file with its own
+    bound of max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttls=None, refresh=False):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.refresh = refresh # Ignore stored entries but still write fresh ones
+        # Daily closes live next to the cache file, as flat per-symbol arrays
+        self.prices = open_price_store(os.path.join(directory, 'prices'), max_bytes)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns the cached value for key, or None if it is missing or expired."""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Looks up several keys in one transaction. Returns {key: value} for the keys that
+        are cached and fresh; missing and expired keys are left out.
+        """
+        keys = list(dict.fromkeys(keys))
+        if self.refresh:
+            instrumentation.increment("cache_lookups_total", len(keys), result="refresh")
+            return {}
+
+        now = time.time()
+        found = {}
+        expired = 0
+        with self._lock:
+            for offset in range(0, len(keys), 500): # Stays below SQLite's limit of bound parameters
+                chunk = keys[offset:offset + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, kind, value, stored_at FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, kind, value, stored_at in rows:
+                    ttl = self.ttls.get(kind)
+                    if ttl is not None and now - stored_at > ttl:
+                        expired += 1
+                        continue
+                    found[key] = value
+
+            for result, count in (("hit", len(found)), ("expired", expired), ("miss", len(keys) - len(found) - expired)):
+                if count:
+                    instrumentation.increment("cache_lookups_total", count, result=result)
+            if found:
+                self._conn.executemany("UPDATE entries SET accessed_at = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+        return {key: json.loads(value) for key, value in found.items()}
+
+    def put_many(self, items):
+        """Stores (key, kind, value) tuples in one transaction, then enforces the size bound."""
+        now = time.time()
+        rows = []
+        for key, kind, value in items:
+            encoded = json.dumps(value, separators=(',', ':'))
+            rows.append((key, kind, encoded, len(encoded), now, now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, kind, value, size, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def put(self, key, kind, value):
+        self.put_many([(key, kind, value)])
+
+    def _evict(self):
+        """Drops least recently used entries until the stored size fits in max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
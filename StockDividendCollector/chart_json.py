@@ -0,0 +1,102 @@
+"""
+A lean reader for Yahoo chart payloads.
+
+A max-range daily chart is mostly six parallel arrays (open, high, low, close, volume,
+adjclose), of which the collector reads only the closes. Instead of building Python
+objects for the whole document, parse_chart() walks its structure and decodes just the
+requested members; every other array of plain numbers is stepped over by finding its
+closing bracket, without creating a single object.
+"""
+
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+_key = re.compile(r'[ \t\n\r]*"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*')
+
+# Members of a chart result the collector reads. "close" is found under indicators.quote[0].
+CHART_FIELDS = ("meta", "timestamp", "events", "close")
+
+def _skip_value(text, pos):
+    """Returns the position after the JSON value that starts at pos."""
+    if text[pos] == '[':
+        end = text.find(']', pos)
+        # A flat array of numbers and nulls ends at the first ']'; anything else is decoded
+        if end != -1 and text.find('[', pos + 1, end) == -1 and text.find('{', pos + 1, end) == -1 and text.find('"', pos + 1, end) == -1:
+            return end + 1
+    return _decoder.raw_decode(text, pos)[1]
+
+def _read_array(text, pos, spec):
+    """Reads an array of objects, scanning each with _read_object(spec). Returns (list, end)."""
+    if text[pos] != '[':
+        return _decoder.raw_decode(text, pos) # e.g. "result": null
+    items = []
+    pos = _whitespace.match(text, pos + 1).end()
+    if text[pos] == ']':
+        return items, pos + 1
+    while True:
+        if text[pos] == '{':
+            item, pos = _read_object(text, pos, spec)
+        else:
+            item, pos = _decoder.raw_decode(text, pos)
+        items.append(item)
+        pos = _whitespace.match(text, pos).end()
+        if text[pos] == ']':
+            return items, pos + 1
+        if text[pos] != ',':
+            raise ValueError(f"Expecting ',' or ']' at position {pos}")
+        pos = _whitespace.match(text, pos + 1).end()
+
+def _read_object(text, pos, spec):
+    """
+    Reads the object at text[pos], decoding only the members named in spec: True decodes
+    the value, a dict descends into an object and a list holds the spec of an array's objects.
+    Returns (dict of the decoded members, end).
+    """
+    if text[pos] != '{':
+        return _decoder.raw_decode(text, pos)
+    found = {}
+    pos = _whitespace.match(text, pos + 1).end()
+    if text[pos] == '}':
+        return found, pos + 1
+    while True:
+        match = _key.match(text, pos)
+        if match is None:
+            raise ValueError(f"Expecting a property name at position {pos}")
+        key, pos = match.group(1), match.end()
+        member_spec = spec.get(key)
+        if member_spec is None:
+            pos = _skip_value(text, pos)
+        elif member_spec is True:
+            found[key], pos = _decoder.raw_decode(text, pos)
+        elif isinstance(member_spec, list):
+            found[key], pos = _read_array(text, pos, member_spec[0])
+        else:
+            found[key], pos = _read_object(text, pos, member_spec)
+
+        pos = _whitespace.match(text, pos).end()
+        if text[pos] == '}':
+            return found, pos + 1
+        if text[pos] != ',':
+            raise ValueError(f"Expecting ',' or '}}' at position {pos}")
+        pos = _whitespace.match(text, pos + 1).end()
+
+def result_spec(fields=CHART_FIELDS):
+    """The _read_object() spec of a chart result for the given CHART_FIELDS."""
+    spec = {field: True for field in fields if field != "close"}
+    if "close" in fields:
+        spec["indicators"] = {"quote": [{"close": True}]}
+    return spec
+
+def parse_chart(text, fields=CHART_FIELDS):
+    """
+    Parses a /v8/finance/chart response body, keeping only `fields` of its results.
+    Returns the "chart" object: {"result": [partial result, ...] or None, "error": ...}.
+    Raises ValueError for a body that is not a chart document.
+    """
+    spec = {"chart": {"result": [result_spec(fields)], "error": True}}
+    document, end = _read_object(text, _whitespace.match(text, 0).end(), spec)
+    if _whitespace.match(text, end).end() != len(text):
+        raise ValueError(f"Extra data at position {end}")
+    return document.get("chart", {})
@@ -1,634 +1,1768 @@
 import requests
 import datetime
 import argparse
+import hashlib
 import os
+import sys
+import json
+import threading
+import tempfile
+import unicodedata
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from itertools import islice
+from typing import Optional
+
+import instrumentation
+from chart_cache import ChartCache, DEFAULT_CACHE_DIR
+from chart_json import CHART_FIELDS, parse_chart
+from price_store import build_history_matrix, chart_closes, is_stale
+from http_client import HttpClient
+from stock_names import open_name_index
+from alerts import AlertEngine, print_alert, webhook_emitter
+from backtest import OUTCOME_LABELS, run_backtest
+from total_return import ReturnIndex, portfolio_returns
+
+# The master name table (stock_list.txt) next to this script
+MASTER_STOCK_NAME_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'stock_list.txt')
 
 def load_stock_names(filepath):
     """
     Loads stock names from a file into a dictionary.
     The file format is expected to be: Chinese Name <whitespace> Stock Code
+    Reads through the prebuilt name index; use open_name_index() for single lookups.
     """
-    stock_names = {}
-    if not os.path.exists(filepath):
-        return stock_names
-
-    with open(filepath, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Replace full-width spaces with regular spaces and split
-            parts = line.replace('　', ' ').split()
-            if len(parts) >= 2:
-                stock_code = parts[-1]
-                # The name is everything except the last part
-                chinese_name = ' '.join(parts[:-1]).strip().replace('"', '')
-                stock_names[stock_code] = chinese_name
-    return stock_names
-
-def get_latest_price_yahoo(stock_code_with_suffix):
+    index = open_name_index(filepath, DEFAULT_CACHE_DIR)
+    if index is None:
+        return {}
+    return dict(index.items())
+
+def open_master_names():
+    """Returns the index of the master name table, or None if there is no stock_list.txt."""
+    return open_name_index(MASTER_STOCK_NAME_FILE, DEFAULT_CACHE_DIR)
+
+# Overridable so benchmarks and tests can point the collector at a local stand-in
+YAHOO_BASE_URL = os.environ.get("YAHOO_BASE_URL", "https://query1.finance.yahoo.com").rstrip('/')
+YAHOO_CHART_URL = YAHOO_BASE_URL + "/v8/finance/chart/{}"
+YAHOO_SPARK_URL = YAHOO_BASE_URL + "/v7/finance/spark"
+
+# Symbols per batched quote (spark) request; 1 fetches every quote with its own chart request
+QUOTE_BATCH_SIZE = 20
+
+# One pooled, rate-limited HTTP client shared by every fetch thread
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def configure_http_client(**options):
+    """Replaces the shared HTTP client (see http_client.HttpClient for the options)."""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = HttpClient(**options)
+        return _http_client
+
+def get_http_client():
+    """Returns the shared HTTP client, creating one with default options on first use."""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+        return _http_client
+
+@instrumentation.timed("fetch")
+def fetch_chart_yahoo(stock_code_with_suffix, log=print, params=None, fields=CHART_FIELDS):
     """
-    Fetch the latest trading price and time for a stock from Yahoo Finance.
-    Returns a tuple of (price, date_string).
+    Fetch the full daily chart of a stock from Yahoo Finance in a single request.
+    The payload holds the meta (latest price), the daily closes and the dividend events,
+    so every per-stock figure can be parsed from it. Only the members named in `fields`
+    are decoded (see chart_json.py); open/high/low/volume are never materialized.
+    Returns the first chart result as a dict, or None on failure.
     """
-    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{stock_code_with_suffix}"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    url = YAHOO_CHART_URL.format(stock_code_with_suffix)
+    if params is None:
+        params = {
+            "range": "max",
+            "interval": "1d",
+            "events": "div"
+        }
 
     try:
-        r = requests.get(url, headers=headers)
+        r = get_http_client().get(url, params=params)
         r.raise_for_status()
-        data = r.json()
-        
-        chart = data.get('chart', {}).get('result', [])
-        if not chart or 'meta' not in chart[0]:
-            print(f"No price data found for stock {stock_code_with_suffix}.")
-            return None, None
-
-        price = chart[0]['meta'].get('regularMarketPrice')
-        timestamp = chart[0]['meta'].get('regularMarketTime')
-        price_date = "N/A"
-        if timestamp:
-            price_date = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
-        
-        return price, price_date
+        with instrumentation.timed("parse_json"):
+            data = parse_chart(r.content.decode('utf-8'), fields)
 
+        chart = data.get('result')
+        if not chart:
+            instrumentation.increment("fetch_errors_total", reason="no_data")
+            log(f"No data found for stock {stock_code_with_suffix}.")
+            return None
+        return chart[0]
+
+    except requests.exceptions.HTTPError as http_err:
+        instrumentation.increment("fetch_errors_total", reason=r.status_code)
+        if r.status_code == 404:
+            log(f"Error: Stock {stock_code_with_suffix} not found on Yahoo Finance (404).")
+        else:
+            log(f"HTTP error occurred: {http_err}")
+        return None
     except Exception as e:
-        print(f"Error fetching price for {stock_code_with_suffix}: {e}")
-        return None, None
+        instrumentation.increment("fetch_errors_total", reason=type(e).__name__)
+        log(f"Error fetching data for {stock_code_with_suffix}: {e}")
+        return None
 
-def fetch_dividend_yahoo(stock_code_with_suffix, year):
+def fetch_quote_yahoo(stock_code_with_suffix, log=print):
+    """Fetches only the latest price of a stock: a one-day chart whose meta holds the quote."""
+    chart = fetch_chart_yahoo(stock_code_with_suffix, log, params={"range": "1d", "interval": "1d"}, fields=("meta",))
+    return parse_quote(chart)
+
+def fetch_quote_batch_yahoo(stock_codes, log=print):
     """
-    Fetch historical cash dividends for a TW stock (TWSE or OTC) from Yahoo Finance JSON.
-    Returns a tuple: (list of dividends, total amount)
+    Fetches the latest prices of several stocks with one spark request.
+    Returns {stock code: quote} for the stocks found in the answer; empty if the request failed.
     """
-    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{stock_code_with_suffix}"
-    params = {
-        "range": "max",
-        "interval": "1d",
-        "events": "div"
-    }
-    headers = {
-        "User-Agent": "Mozilla/5.0"
-    }
-
+    params = {"symbols": ",".join(stock_codes), "range": "1d", "interval": "1d"}
     try:
-        r = requests.get(url, headers=headers, params=params)
+        r = get_http_client().get(YAHOO_SPARK_URL, params=params)
         r.raise_for_status()
-        data = r.json()
+        with instrumentation.timed("parse_json"):
+            data = r.json()
+    # Failures are not logged: the caller falls back to one chart request per stock
+    except requests.exceptions.HTTPError:
+        instrumentation.increment("quote_batches_total", result=r.status_code)
+        return {}
+    except Exception as e:
+        instrumentation.increment("quote_batches_total", result=type(e).__name__)
+        return {}
+
+    instrumentation.increment("quote_batches_total", result="ok")
+    quotes = {}
+    for item in (data.get('spark') or {}).get('result') or []:
+        responses = item.get('response') or []
+        quote = parse_quote(responses[0]) if responses else None
+        if item.get('symbol') and quote and quote["price"] is not None:
+            quotes[item['symbol']] = quote
+    return quotes
+
+def fetch_quotes_yahoo(stock_codes, log=print, batch_size=QUOTE_BATCH_SIZE, executor=None):
+    """
+    Fetches the latest prices of many stocks, batch_size symbols per request. Stocks
+    missing from a batch answer (or in a failed batch) are fetched one by one with
+    fetch_quote_yahoo(). Runs the requests on executor when one is given.
+    Returns {stock code: quote or None}.
+    """
+    stock_codes = list(dict.fromkeys(stock_codes))
+    run = executor.map if executor is not None else map
+    quotes = {}
+    if batch_size > 1:
+        chunks = [stock_codes[i:i + batch_size] for i in range(0, len(stock_codes), batch_size)]
+        for batch_quotes in run(lambda chunk: fetch_quote_batch_yahoo(chunk, log), chunks):
+            quotes.update(batch_quotes)
+
+    missing = [stock_code for stock_code in stock_codes if stock_code not in quotes]
+    for stock_code, quote in zip(missing, run(lambda stock_code: fetch_quote_yahoo(stock_code, log), missing)):
+        quotes[stock_code] = quote
+    return quotes
+
+def parse_quote(chart):
+    """Reads the latest price and its unix time from a chart result's meta, or None."""
+    if not chart or 'meta' not in chart:
+        return None
+    return {
+        "price": chart['meta'].get('regularMarketPrice'),
+        "time": chart['meta'].get('regularMarketTime')
+    }
 
-        chart = data.get('chart', {}).get('result', [])
-        if not chart:
-            print(f"No data found for stock {stock_code_with_suffix}.")
-            return [], 0.0
-
-        div_events = chart[0].get('events', {}).get('dividends', {})
-        if not div_events:
-            print(f"No dividend info found for stock {stock_code_with_suffix} in {year}.")
-            return [], 0.0
-
-        filtered = []
-        total_dividend = 0.0
-        for div in div_events.values():
-            date_ts = div['date']
-            date = datetime.datetime.fromtimestamp(date_ts)
-            if date.year == year:
-                amount = div['amount']
-                filtered.append({
-                    "Date": date.strftime("%Y-%m-%d"),
-                    "Amount": amount
-                })
-                total_dividend += amount
+def quote_to_price(quote, stock_code_with_suffix, log=print):
+    """
+    Turns a parsed quote into the latest trading price and its date.
+    Returns a tuple of (price, date_string).
+    """
+    if not quote:
+        log(f"No price data found for stock {stock_code_with_suffix}.")
+        return None, None
 
-        return filtered, total_dividend
+    price_date = "N/A"
+    if quote['time']:
+        price_date = datetime.datetime.fromtimestamp(quote['time']).strftime('%Y-%m-%d')
 
-    except requests.exceptions.HTTPError as http_err:
-        if r.status_code == 404:
-            print(f"Error: Stock {stock_code_with_suffix} not found on Yahoo Finance (404).")
-        else:
-            print(f"HTTP error occurred: {http_err}")
-        return [], 0.0
-    except Exception as e:
-        print(f"Error fetching data for {stock_code_with_suffix}: {e}")
-        return [], 0.0
+    return quote['price'], price_date
 
-def get_price_change_yahoo(stock_code_with_suffix, year):
+def parse_latest_price(chart, stock_code_with_suffix, log=print):
     """
-    Fetches the first and last trading day prices for a given year and calculates the percentage change.
+    Reads the latest trading price and time from a chart result.
+    Returns a tuple of (price, date_string).
     """
-    start_date = int(datetime.datetime(year, 1, 1).timestamp())
-    end_date = int(datetime.datetime(year, 12, 31).timestamp())
+    return quote_to_price(parse_quote(chart), stock_code_with_suffix, log)
 
-    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{stock_code_with_suffix}"
-    params = {
-        "period1": start_date,
-        "period2": end_date,
-        "interval": "1d"
-    }
-    headers = {"User-Agent": "Mozilla/5.0"}
+def _empty_year_bucket():
+    return {"dividends": [], "first_close": None, "last_close": None, "close_count": 0}
+
+@instrumentation.timed("bucket")
+def bucket_chart_by_year(chart):
+    """
+    Groups the dividend events and daily closes of a chart result by calendar year in one pass.
+    Returns {year: {"dividends": [...], "first_close": x, "last_close": y, "close_count": n}}
+    """
+    buckets = {}
+    if not chart:
+        return buckets
+
+    timestamps = chart.get('timestamp') or []
+    close_prices = []
+    if 'indicators' in chart:
+        close_prices = chart['indicators']['quote'][0].get('close') or []
+
+    for timestamp, close in zip(timestamps, close_prices):
+        # None values can appear for non-trading days
+        if close is None:
+            continue
+        year = datetime.datetime.fromtimestamp(timestamp).year
+        bucket = buckets.get(year)
+        if bucket is None:
+            bucket = buckets[year] = _empty_year_bucket()
+        if bucket["first_close"] is None:
+            bucket["first_close"] = close
+        bucket["last_close"] = close
+        bucket["close_count"] += 1
+
+    div_events = chart.get('events', {}).get('dividends', {})
+    for div in sorted(div_events.values(), key=lambda d: d['date']):
+        date = datetime.datetime.fromtimestamp(div['date'])
+        bucket = buckets.get(date.year)
+        if bucket is None:
+            bucket = buckets[date.year] = _empty_year_bucket()
+        bucket["dividends"].append({
+            "Date": date.strftime("%Y-%m-%d"),
+            "Amount": div['amount']
+        })
+
+    return buckets
+
+def year_figures(bucket):
+    """
+    Reads the dividends and the first-to-last close change from a year bucket.
+    Returns a tuple: (list of dividends, total amount, price change %)
+    """
+    dividends = bucket["dividends"]
+    total_dividend = sum((d["Amount"] for d in dividends), 0.0)
 
+    price_change = None
+    if bucket["close_count"] >= 2: # Need two closes to compare
+        first_price = bucket["first_close"]
+        last_price = bucket["last_close"]
+        price_change = ((last_price - first_price) / first_price) * 100
+
+    return dividends, total_dividend, price_change
+
+def merge_year_buckets(buckets):
+    """Combines consecutive year buckets into one bucket spanning all of them."""
+    merged = _empty_year_bucket()
+    for bucket in buckets:
+        merged["dividends"].extend(bucket["dividends"])
+        if bucket["close_count"]:
+            if merged["first_close"] is None:
+                merged["first_close"] = bucket["first_close"]
+            merged["last_close"] = bucket["last_close"]
+            merged["close_count"] += bucket["close_count"]
+    return merged
+
+def parse_year_range(value):
+    """
+    Parses a -y/--year value: a single year ("2023") or an inclusive range ("2019-2024").
+    Returns the list of years in ascending order.
+    """
     try:
-        r = requests.get(url, headers=headers, params=params)
-        r.raise_for_status()
-        data = r.json()
+        if '-' in value:
+            start, end = (int(part) for part in value.split('-', 1))
+        else:
+            start = end = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid year or year range: {value} (use e.g. 2023 or 2019-2024)")
 
-        chart = data.get('chart', {}).get('result', [])
-        if not chart or 'indicators' not in chart[0]:
-            return None
+    if start > end:
+        raise argparse.ArgumentTypeError(f"Invalid year range: {value} (start year is after end year)")
+    return list(range(start, end + 1))
 
-        quotes = chart[0]['indicators']['quote'][0]
-        close_prices = quotes.get('close', [])
-        
-        # Filter out None values which can appear for non-trading days
-        valid_prices = [p for p in close_prices if p is not None]
+def format_year_label(years):
+    """Returns the label used in report titles, e.g. "2023" or "2019-2024"."""
+    if len(years) == 1:
+        return str(years[0])
+    return f"{years[0]}-{years[-1]}"
 
-        if len(valid_prices) < 2:
-            return None # Not enough data to compare
+def get_latest_price_yahoo(stock_code_with_suffix):
+    """
+    Fetch the latest trading price and time for a stock from Yahoo Finance.
+    Returns a tuple of (price, date_string).
+    """
+    return quote_to_price(fetch_quote_yahoo(stock_code_with_suffix), stock_code_with_suffix)
 
-        first_price = valid_prices[0]
-        last_price = valid_prices[-1]
+def fetch_dividend_yahoo(stock_code_with_suffix, year):
+    """
+    Fetch historical cash dividends for a TW stock (TWSE or OTC) from Yahoo Finance JSON.
+    Returns a tuple: (list of dividends, total amount)
+    """
+    # The dividend events cover the whole range whatever the interval, so quarterly bars keep the payload small
+    chart = fetch_chart_yahoo(
+        stock_code_with_suffix, params={"range": "max", "interval": "3mo", "events": "div"}, fields=("events",)
+    )
+    bucket = bucket_chart_by_year(chart).get(year, _empty_year_bucket())
+    dividends, total, _ = year_figures(bucket)
+    return dividends, total
 
-        price_change = ((last_price - first_price) / first_price) * 100
-        return price_change
+# Seconds after which a stored price history is brought up to date before a query that reaches past it
+PRICE_SYNC_AGE = 3600
 
-    except Exception as e:
-        print(f"Error fetching price change for {stock_code_with_suffix}: {e}")
+def sync_cached_stock(cache, stock_code_with_suffix, log=print):
+    """
+    Brings a cached stock up to date with one request for the trading days since its last
+    stored close: their closes are appended to the price store, their dividends added to the
+    cached year buckets and the quote is refreshed.
+    Returns (quote, {year: bucket} from the last stored year on), or None when the stock has
+    no stored closes or year bucket to extend, or the download failed.
+    """
+    last_day = cache.prices.last_day(stock_code_with_suffix)
+    if last_day is None:
+        return None
+    years = range(last_day.year, datetime.date.today().year + 1)
+    stored = cache.get_many(f"year:{stock_code_with_suffix}:{year}" for year in years)
+    if f"year:{stock_code_with_suffix}:{last_day.year}" not in stored:
         return None
 
-def str_display_width(s):
-    """Calculates the display width of a string, accounting for wide characters."""
-    width = 0
-    for char in s:
-        # CJK Unified Ideographs, half/full-width forms
-        if ('\u4e00' <= char <= '\u9fff' or
-            '\u3000' <= char <= '\u303f' or
-            '\uff00' <= char <= '\uffef'):
-            width += 2
+    # The last stored close is fetched again, it may have been an intraday price
+    period_start = datetime.datetime.combine(last_day, datetime.time.min)
+    params = {"period1": int(period_start.timestamp()), "period2": int(datetime.datetime.now().timestamp()), "interval": "1d", "events": "div"}
+    instrumentation.increment("price_syncs_total", kind="incremental")
+    chart = fetch_chart_yahoo(stock_code_with_suffix, log, params=params)
+    if chart is None:
+        return None
+    cache.prices.append(stock_code_with_suffix, *chart_closes(chart))
+
+    new_buckets = bucket_chart_by_year(chart)
+    year_buckets = {}
+    for year in years:
+        bucket = stored.get(f"year:{stock_code_with_suffix}:{year}") or _empty_year_bucket()
+        dividends = list(bucket["dividends"])
+        # A dividend on the last stored day is sent again
+        dividends.extend(d for d in new_buckets.get(year, _empty_year_bucket())["dividends"] if d not in dividends)
+        year_buckets[year] = dict(bucket, dividends=dividends)
+    year_buckets = stored_closes(cache.prices, stock_code_with_suffix, year_buckets)
+
+    items = [(f"year:{stock_code_with_suffix}:{year}", "history", bucket) for year, bucket in year_buckets.items()]
+    quote = parse_quote(chart)
+    if quote:
+        items.append((f"quote:{stock_code_with_suffix}", "quote", quote))
+    cache.put_many(items)
+    return quote, year_buckets
+
+def stored_closes(store, stock_code_with_suffix, year_buckets):
+    """
+    Returns the year buckets with their first close, last close and close count read from
+    the price store. A stock the store does not hold keeps the closes of its buckets.
+    """
+    days, closes = store.closes(stock_code_with_suffix)
+    if not len(days):
+        return year_buckets
+
+    buckets = {}
+    for year, bucket in year_buckets.items():
+        low = int(np.searchsorted(days, datetime.date(year, 1, 1).toordinal(), 'left'))
+        high = int(np.searchsorted(days, datetime.date(year, 12, 31).toordinal(), 'right'))
+        if low < high:
+            bucket = dict(bucket, first_close=float(closes[low]), last_close=float(closes[high - 1]), close_count=high - low)
         else:
-            width += 1
-    return width
+            bucket = dict(bucket, first_close=None, last_close=None, close_count=0)
+        buckets[year] = bucket
+    return buckets
 
-def generate_yield_chart(summary, year):
-    """Generates and prints a text-based bar chart for dividend yields."""
-    
-    print(f"\n=== Dividend Yield Chart ({year}) ===")
-    
-    chart_data = {}
-    max_yield = 0.0
-    for stock, (total, name, price, price_date, shares, price_change, _, _, _, _) in summary.items(): # Added placeholders
-        yield_val = 0.0
-        if total > 0 and price is not None and price > 0:
-            yield_val = (total / price) * 100
-        
-        if yield_val > 0:
-            chart_data[stock] = {"yield": yield_val, "name": name, "price_change": price_change}
-            if yield_val > max_yield:
-                max_yield = yield_val
-
-    if not chart_data or max_yield == 0:
-        print("No yield data available to generate a chart.")
-        print("================================================================")
+def cache_chart(cache, stock_code_with_suffix, chart):
+    """
+    Stores the quote and the per-year buckets of a chart result in the cache, and its daily
+    closes in the price store. The buckets are kept as history: the running year is brought
+    up to date by sync_cached_stock(). The quote expires.
+    """
+    items = []
+    quote = parse_quote(chart)
+    if quote:
+        items.append((f"quote:{stock_code_with_suffix}", "quote", quote))
+
+    buckets = bucket_chart_by_year(chart)
+    if buckets:
+        current_year = datetime.date.today().year
+        first_year = min(buckets)
+        # Lets years before the listing resolve to empty data without a download
+        items.append((f"span:{stock_code_with_suffix}", "history", {"first_year": first_year}))
+        for year in range(first_year, current_year + 1):
+            items.append((f"year:{stock_code_with_suffix}:{year}", "history", buckets.get(year, _empty_year_bucket())))
+
+    if items:
+        cache.put_many(items)
+    # Only the days after the last stored one are written
+    cache.prices.append(stock_code_with_suffix, *chart_closes(chart))
+
+def load_cached_stocks(cache, stock_codes, years):
+    """
+    Looks up the cached parts of several stocks with one cache transaction.
+    Returns {stock code: (quote or None if expired, {year: bucket} or None if any year has to be downloaded)}.
+    """
+    keys = []
+    for stock_code in stock_codes:
+        keys.append(f"quote:{stock_code}")
+        keys.append(f"span:{stock_code}")
+        keys.extend(f"year:{stock_code}:{year}" for year in years)
+    found = cache.get_many(keys)
+
+    cached = {}
+    for stock_code in stock_codes:
+        span = found.get(f"span:{stock_code}")
+        year_buckets = {}
+        for year in years:
+            bucket = found.get(f"year:{stock_code}:{year}")
+            if bucket is None and span is not None and year < span["first_year"]:
+                bucket = _empty_year_bucket() # Before the listing
+            if bucket is None:
+                year_buckets = None
+                break
+            year_buckets[year] = bucket
+        cached[stock_code] = (found.get(f"quote:{stock_code}"), year_buckets)
+    return cached
+
+def load_cached_stock(cache, stock_code_with_suffix, years):
+    """Looks up the cached parts of one stock, see load_cached_stocks()."""
+    return load_cached_stocks(cache, [stock_code_with_suffix], years)[stock_code_with_suffix]
+
+def prefetch_quotes(cache, stock_codes, years, batch_size=QUOTE_BATCH_SIZE, log=print, executor=None):
+    """
+    Looks up the cached parts of several stocks and refreshes, in batches, the expired
+    quotes of those whose history is cached, so they need no chart request at all.
+    Returns ({stock code: load_cached_stock() result}, set of the stock codes still without
+    a quote after the one-by-one fallback) for fetch_stock_data(cached=..., quote_tried=...).
+    """
+    cached = load_cached_stocks(cache, stock_codes, years)
+    expired = [stock_code for stock_code, (quote, year_buckets) in cached.items() if quote is None and year_buckets is not None]
+    unquoted = set()
+    if expired:
+        items = []
+        for stock_code, quote in fetch_quotes_yahoo(expired, log, batch_size, executor).items():
+            if quote is not None:
+                cached[stock_code] = (quote, cached[stock_code][1])
+                items.append((f"quote:{stock_code}", "quote", quote))
+            else:
+                unquoted.add(stock_code)
+        if items:
+            cache.put_many(items)
+    return cached, unquoted
+
+def fetch_stock_data(stock_code_with_suffix, years, cache=None, log=print, cached=None, quote_tried=False):
+    """
+    Fetches the year buckets of the requested years and the latest price for one stock
+    from a single chart request, or from the cache when the history is cached (then an
+    expired price costs only a one-day quote, and a running year last synced more than
+    PRICE_SYNC_AGE ago only the days since). The closes of cached years come from the
+    price store. `cached` is a load_cached_stock() result that was already looked up,
+    e.g. by prefetch_quotes(); quote_tried means its expired quote was already requested
+    one by one without an answer, so the full chart is downloaded instead.
+    Returns a tuple: ({year: bucket}, price, price_date)
+    """
+    if cache is not None:
+        quote, year_buckets = cached if cached is not None else load_cached_stock(cache, stock_code_with_suffix, years)
+        if (year_buckets is not None and years[-1] >= datetime.date.today().year
+                and is_stale(cache.prices, stock_code_with_suffix, None, PRICE_SYNC_AGE)):
+            synced = sync_cached_stock(cache, stock_code_with_suffix, log)
+            if synced is None:
+                year_buckets = None # Download the full chart
+            else:
+                quote = synced[0] or quote
+                year_buckets = {year: synced[1].get(year, bucket) for year, bucket in year_buckets.items()}
+        if year_buckets is not None and quote is None and not quote_tried:
+            quote = fetch_quote_yahoo(stock_code_with_suffix, log)
+            if quote is not None:
+                cache.put(f"quote:{stock_code_with_suffix}", "quote", quote)
+        if year_buckets is not None and quote is not None:
+            price, price_date = quote_to_price(quote, stock_code_with_suffix, log)
+            return stored_closes(cache.prices, stock_code_with_suffix, year_buckets), price, price_date
+
+    chart = fetch_chart_yahoo(stock_code_with_suffix, log)
+    if cache is not None and chart is not None:
+        cache_chart(cache, stock_code_with_suffix, chart)
+
+    all_buckets = bucket_chart_by_year(chart)
+    year_buckets = {year: all_buckets.get(year, _empty_year_bucket()) for year in years}
+    price, price_date = parse_latest_price(chart, stock_code_with_suffix, log)
+    return year_buckets, price, price_date
+
+@dataclass(slots=True)
+class StockSummary:
+    """One stock's inputs for a period. Derived metrics live in PortfolioMetrics."""
+    total: float                  # Cash dividend per share in the period
+    name: str
+    price: Optional[float]
+    price_date: Optional[str]
+    shares: Optional[int]
+    price_change: Optional[float] # First-to-last close change of the period, in %
+    bought_price: Optional[float]
+    low_rate_threshold: Optional[float]
+    high_rate_threshold: Optional[float]
+    dividends: list
+
+def _column(records, attribute):
+    """Returns one attribute of all records as a float array, with NaN for None."""
+    return np.array([getattr(record, attribute) for record in records], dtype=float)
+
+def _as_optional_list(values):
+    """Converts a float array to a list with None in place of NaN."""
+    return [None if value != value else value for value in values.tolist()]
+
+def position_metrics(total, price, shares, bought_price, low_rate_threshold, high_rate_threshold):
+    """
+    The per-position formulas, for whole columns or for the float64 scalars of one position.
+    Missing inputs are NaN and propagate. Returns (yield %, market value, net P/L, P/L %,
+    take-profit flag, cut-loss flag).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Comparisons with NaN are False, so missing prices drop out of every mask
+        yield_pct = np.where((total > 0) & (price > 0), total / price * 100, np.nan)
+        market_value = price * shares
+        net_pl = (price - bought_price) * shares
+        percent_pl = np.where(
+            (bought_price > 0) & ~np.isnan(net_pl),
+            (price - bought_price) / bought_price * 100,
+            np.nan
+        )
+    take_profit = percent_pl >= high_rate_threshold
+    cut_loss = ~take_profit & (percent_pl <= low_rate_threshold)
+    return yield_pct, market_value, net_pl, percent_pl, take_profit, cut_loss
+
+class PortfolioMetrics:
+    """
+    Every per-stock metric of a summary as column arrays, in summary order.
+    Missing inputs are NaN and propagate, so each metric is computed for all
+    stocks at once instead of row by row.
+    """
+
+    @instrumentation.timed("metrics")
+    def __init__(self, summary):
+        records = list(summary.values())
+        self.stocks = list(summary.keys())
+        self.names = [record.name for record in records]
+        self.price_dates = [record.price_date for record in records]
+        self.shares_list = [record.shares for record in records]
+        self.dividends = [record.dividends for record in records]
+
+        self.total = _column(records, 'total')
+        self.price = _column(records, 'price')
+        self.shares = _column(records, 'shares')
+        self.price_change = _column(records, 'price_change')
+        self.bought_price = _column(records, 'bought_price')
+        self.low_rate_threshold = _column(records, 'low_rate_threshold')
+        self.high_rate_threshold = _column(records, 'high_rate_threshold')
+
+        (self.yield_pct, self.market_value, self.net_pl, self.percent_pl,
+         self.take_profit, self.cut_loss) = position_metrics(
+            self.total, self.price, self.shares, self.bought_price, self.low_rate_threshold, self.high_rate_threshold
+        )
+        with np.errstate(invalid='ignore'):
+            self.dividend_value = np.where(self.total > 0, self.total * self.shares, np.nan) # Dividends for the shares held
+        self.combined_performance = self.yield_pct + self.price_change   # yield + price change
+        self.subtracted_performance = self.yield_pct - self.price_change # yield - price change
+
+    def signals(self):
+        return np.where(self.take_profit, "Take-Profit", np.where(self.cut_loss, "Cut-Loss", "")).tolist()
+
+    def totals(self):
+        """Aggregates the columns into whole-portfolio figures."""
+        return {
+            "stocks": len(self.stocks),
+            "dividend_income": float(np.nansum(self.total * self.shares)),
+            "total_value": float(np.nansum(self.market_value)),
+            "net_pl": float(np.nansum(self.net_pl)),
+            "take_profit": int(self.take_profit.sum()),
+            "cut_loss": int(self.cut_loss.sum())
+        }
+
+@lru_cache(maxsize=None)
+def char_display_width(char):
+    """Terminal columns of one character: 2 for East Asian wide and fullwidth characters, else 1."""
+    return 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+
+@lru_cache(maxsize=65536)
+def str_display_width(s):
+    """Calculates the display width of a string, accounting for wide characters."""
+    if s.isascii():
+        return len(s)
+    return sum(map(char_display_width, s))
+
+def write_text(lines, out=None):
+    """Writes rendered lines to out (stdout by default) with a single write call."""
+    (out if out is not None else sys.stdout).write("\n".join(lines) + "\n")
+
+class ChartLabels:
+    """The "00878.TW (Name)" label of every stock in a period and its display width, shared by the charts."""
+
+    def __init__(self, metrics):
+        self.labels = [f"{stock} ({name})" for stock, name in zip(metrics.stocks, metrics.names)]
+        self.widths = [str_display_width(label) for label in self.labels]
+
+    def padded(self, order):
+        """The labels of the given rows, padded to the widest of them."""
+        max_label_width = max(self.widths[i] for i in order)
+        return [self.labels[i] + ' ' * (max_label_width - self.widths[i]) for i in order]
+
+def render_yield_chart(metrics, year, lines, labels=None):
+    """Appends a text-based bar chart for dividend yields to lines."""
+    lines.append(f"\n=== Dividend Yield Chart ({year}) ===")
+
+    yields = metrics.yield_pct
+    selected = np.flatnonzero(yields > 0)
+    if selected.size == 0:
+        lines.append("No yield data available to generate a chart.")
+        lines.append("================================================================")
         return
 
-    # Calculate max width for the label part (e.g., "00878.TW (Name)")
-    max_label_width = 0
-    for stock, data in chart_data.items():
-        label = f"{stock} ({data['name']})"
-        max_label_width = max(max_label_width, str_display_width(label))
+    max_yield = yields[selected].max()
+    # Sort stocks by yield (stable, so ties keep the input order)
+    order = selected[np.argsort(-yields[selected], kind='stable')].tolist()
+    padded_labels = (labels or ChartLabels(metrics)).padded(order)
 
     max_bar_width = 40 # Reduced to make space for the new text
-    
-    # Sort stocks by yield
-    sorted_stocks = sorted(chart_data.items(), key=lambda item: item[1]['yield'], reverse=True)
-
-    for stock, data in sorted_stocks:
-        yield_val = data['yield']
-        name = data['name']
-        price_change = data['price_change']
-        
-        label = f"{stock} ({name})"
-        label_padding = max_label_width - str_display_width(label)
-        
-        bar_length = int((yield_val / max_yield) * max_bar_width)
-        bar = '#' * bar_length
+    bar_lengths = (yields[order] / max_yield * max_bar_width).astype(int).tolist()
+    price_changes = _as_optional_list(metrics.price_change[order])
 
+    for label, yield_val, bar_length, price_change in zip(padded_labels, yields[order].tolist(), bar_lengths, price_changes):
         price_change_str = ""
         if price_change is not None:
             price_change_str = f"(Change: {price_change:+.2f}%)"
-        
-        print(f"{label}{' ' * label_padding}                             | {bar} {yield_val:.2f}% {price_change_str}")
-        
-    print("==========================================================")
 
-def generate_combined_performance_chart(summary, year):
-    """Generates and prints a text-based bar chart for combined yield and price change."""
-    
-    print(f"\n=== Combined Performance Chart ({year}) ===")
-                 
-    chart_data = {}
-    max_combined_performance = 0.0
-    for stock, (total, name, price, price_date, shares, price_change, _, _, _, _) in summary.items(): # Added placeholders
-        yield_val = 0.0
-        if total > 0 and price is not None and price > 0:
-            yield_val = (total / price) * 100
-        
-        # Only include stocks that have a positive yield (and are thus in the first chart)
-        if yield_val > 0:
-            combined_performance = None
-            if price_change is not None:
-                combined_performance = yield_val + price_change
-            
-            if combined_performance is not None:
-                chart_data[stock] = {"performance": combined_performance, "name": name}
-                if abs(combined_performance) > max_combined_performance:
-                    max_combined_performance = abs(combined_performance)
-
-    if not chart_data or max_combined_performance == 0:
-        print("No combined performance data available to generate a chart.")
-        print("================================================================")
+        lines.append(f"{label}                             | {'#' * bar_length} {yield_val:.2f}% {price_change_str}")
+
+    lines.append("==========================================================")
+
+def render_performance_chart(lines, labels, performance, selected, bar_char, max_bar_width=50):
+    """Appends the bars of a signed performance chart, largest first; negative values are drawn with '-'."""
+    order = selected[np.argsort(-performance[selected], kind='stable')].tolist()
+    padded_labels = labels.padded(order)
+    bar_lengths = (np.abs(performance[order]) / np.abs(performance[selected]).max() * max_bar_width).astype(int).tolist()
+
+    for label, performance_val, bar_length in zip(padded_labels, performance[order].tolist(), bar_lengths):
+        bar = ('-' if performance_val < 0 else bar_char) * bar_length
+        lines.append(f"{label}                             | {bar} {performance_val:+.2f}%") # + shows the sign of positive numbers
+
+    lines.append("==========================================================")
+
+def render_combined_performance_chart(metrics, year, lines, labels=None):
+    """Appends a text-based bar chart for combined yield and price change to lines."""
+    lines.append(f"\n=== Combined Performance Chart ({year}) ===")
+
+    performance = metrics.combined_performance
+    # Only include stocks that have a positive yield (and are thus in the first chart)
+    selected = np.flatnonzero((metrics.yield_pct > 0) & ~np.isnan(performance))
+    if selected.size == 0 or np.abs(performance[selected]).max() == 0:
+        lines.append("No combined performance data available to generate a chart.")
+        lines.append("================================================================")
         return
 
-    # Calculate max width for the label part
-    max_label_width = 0
-    for stock, data in chart_data.items():
-        label = f"{stock} ({data['name']})"
-        max_label_width = max(max_label_width, str_display_width(label))
+    render_performance_chart(lines, labels or ChartLabels(metrics), performance, selected, '*')
+
+def render_subtracted_performance_chart(metrics, year, lines, labels=None):
+    """Appends a bar chart for yield rate minus price change to lines."""
+    lines.append(f"\n=== Yield Rate minus Price Change Rate Chart ({year}) ===")
+
+    performance = metrics.subtracted_performance
+    # Only include stocks that have a positive yield
+    selected = np.flatnonzero((metrics.yield_pct > 0) & ~np.isnan(performance))
+    if selected.size == 0 or np.abs(performance[selected]).max() == 0:
+        lines.append("No data available to generate a chart.")
+        lines.append("=============================================================")
+        return
+
+    render_performance_chart(lines, labels or ChartLabels(metrics), performance, selected, '~')
+
+# Summary table columns: (key, header, right-aligned)
+SUMMARY_COLUMNS = [
+    ("stock", "Stock", False), ("name", "Name", False), ("price", "Price", True),
+    ("dividend", "Dividend", True), ("yield", "Yield", True), ("shares", "Shares", True),
+    ("total_value", "Total Value", True), ("net_pl", "P/L", True), ("percent_pl", "P/L %", True),
+    ("signal", "Signal", False)
+]
+
+def _format_optional(values, template, missing):
+    return [missing if value is None else template.format(value) for value in values]
+
+def render_table(columns, headers, cells, lines, wide_keys=("stock", "name", "portfolio")):
+    """
+    Appends a header line, a rule and one line per row of column-wise formatted cells.
+    Only the wide_keys columns can hold wide characters; the other cells are ASCII.
+    """
+    keys = [key for key, _, _ in columns]
+    widths = {key: list(map(str_display_width if key in wide_keys else len, cells[key])) for key in keys}
+    max_widths = {key: max([str_display_width(headers[key])] + widths[key]) for key in keys}
+
+    header_line = "  ".join(
+        f"{headers[key]:>{max_widths[key]}}" if right else f"{headers[key]:<{max_widths[key]}}"
+        for key, _, right in columns
+    )
+    lines.append(header_line)
+    lines.append("-" * str_display_width(header_line))
+
+    # Pad by display width, so wide characters line up
+    padded = {}
+    for key, _, right in columns:
+        max_width = max_widths[key]
+        if right:
+            padded[key] = [value.rjust(max_width) for value in cells[key]]
+        else:
+            padded[key] = [value + ' ' * (max_width - width) for value, width in zip(cells[key], widths[key])]
+    lines.extend("  ".join(row) for row in zip(*(padded[key] for key in keys)))
+
+def render_summary_report(metrics, year, lines):
+    """Appends the summary table and the three charts for one period to lines."""
+    lines.append(f"\n=== Dividend Summary ({year}) ===")
+
+    price_header_date = ""
+    for p_date in metrics.price_dates:
+        if p_date and p_date != "N/A":
+            price_header_date = p_date
+            break
+
+    headers = {key: header for key, header, _ in SUMMARY_COLUMNS}
+    if price_header_date:
+        headers["price"] = f"Price ({price_header_date})"
+
+    # Every cell of a column is formatted at once; the widths follow from the formatted cells
+    cells = {
+        "stock": metrics.stocks,
+        "name": metrics.names,
+        "price": _format_optional(_as_optional_list(metrics.price), "{:.2f}", "N/A"),
+        "dividend": [f"{total:.2f}" for total in metrics.total.tolist()],
+        "yield": _format_optional(_as_optional_list(metrics.yield_pct), "{:.2f}%", "N/A"),
+        "shares": _format_optional(metrics.shares_list, "{}", ""),
+        "total_value": _format_optional(_as_optional_list(metrics.dividend_value), "{:,.2f}", ""),
+        "net_pl": _format_optional(_as_optional_list(metrics.net_pl), "{:,.2f}", "N/A"),
+        "percent_pl": _format_optional(_as_optional_list(metrics.percent_pl), "{:+.2f}%", "N/A"),
+        "signal": metrics.signals()
+    }
+    render_table(SUMMARY_COLUMNS, headers, cells, lines)
+
+    lines.append("===================================================================================")
+
+    labels = ChartLabels(metrics)
+    render_yield_chart(metrics, year, lines, labels)
+    render_combined_performance_chart(metrics, year, lines, labels)
+    render_subtracted_performance_chart(metrics, year, lines, labels)
+
+def _json_row(stock, name, total, yield_val, price, p_date, shares, total_value, net_pl, percent_pl, signal, dividends):
+    """One row of the JSON block; missing metrics are already 0 and missing shares None."""
+    s_count = shares if shares else 0
+    # Adjust dividend events to reflect real total profit (Amount * shares)
+    adjusted_events = []
+    for ev in dividends:
+        adjusted_events.append({
+            "Date": ev["Date"],
+            "Amount": ev["Amount"] * s_count
+        })
+
+    return {
+        "stock": stock,
+        "name": name,
+        "dividend": total,  # Dividend per share only
+        "yield": yield_val,
+        "price": price if price else 0,
+        "price_date": p_date,
+        "shares": s_count,
+        "total_value": total_value,
+        "net_pl": net_pl,
+        "percent_pl": percent_pl,
+        "signal": signal,
+        "events": adjusted_events
+    }
+
+def record_json_row(stock, record):
+    """The JSON row of a single StockSummary, from the position_metrics() formulas."""
+    total, price, shares, bought_price, low_rate_threshold, high_rate_threshold = (
+        np.float64(np.nan if value is None else value) for value in (
+            record.total, record.price, record.shares, record.bought_price,
+            record.low_rate_threshold, record.high_rate_threshold
+        )
+    )
+    yield_pct, market_value, net_pl, percent_pl, take_profit, cut_loss = position_metrics(
+        total, price, shares, bought_price, low_rate_threshold, high_rate_threshold
+    )
+    signal = "Take-Profit" if take_profit else "Cut-Loss" if cut_loss else ""
+    yield_pct, market_value, net_pl, percent_pl = (
+        0.0 if value != value else float(value) for value in (yield_pct, market_value, net_pl, percent_pl)
+    )
+    return _json_row(
+        stock, record.name, float(record.total), yield_pct, record.price, record.price_date,
+        record.shares, market_value, net_pl, percent_pl, signal, record.dividends
+    )
 
-    max_bar_width = 50 # characters
+@instrumentation.timed("summarize")
+def summarize_stock(fetched, years, name, shares, bought_price, low_rate_threshold, high_rate_threshold):
+    """
+    Builds the summary records of one stock from its fetch_stock_data() result.
+    Returns ({year: StockSummary}, StockSummary of the whole period).
+    """
+    year_buckets, price, price_date = fetched
+
+    yearly_records = {}
+    for year in years:
+        dividends, total, price_change = year_figures(year_buckets[year])
+        yearly_records[year] = StockSummary(total, name, price, price_date, shares, price_change, bought_price, low_rate_threshold, high_rate_threshold, dividends)
+
+    # The cross-year row: all dividends of the period, first close to last close
+    dividends, total, price_change = year_figures(merge_year_buckets(year_buckets[year] for year in years))
+    period_record = StockSummary(total, name, price, price_date, shares, price_change, bought_price, low_rate_threshold, high_rate_threshold, dividends)
+    return yearly_records, period_record
+
+def build_stock_json_row(stock_code, period_record, yearly_records, year_label):
+    """Builds one stock's JSON row; a multi-year row carries its per-year breakdown."""
+    row = record_json_row(stock_code, period_record)
+    if len(yearly_records) > 1:
+        row["period"] = year_label
+        row["years"] = [dict(record_json_row(stock_code, record), year=year) for year, record in yearly_records.items()]
+    return row
+
+def parse_portfolio_line(line):
+    """
+    Parses one input file line: [Name] <Stock Code> [Shares] [Bought Price] [Threshold 1] [Threshold 2].
+    Returns (stock_code, name, shares, bought_price, low_rate_threshold, high_rate_threshold)
+    with None for missing parts, or None if the line has no valid stock code.
+    """
+    parts = line.replace('　', ' ').split()
+    identified_stock_code = None
     
-    # Sort stocks by combined performance
-    sorted_stocks = sorted(chart_data.items(), key=lambda item: item[1]['performance'], reverse=True)
-
-    for stock, data in sorted_stocks:
-        performance_val = data['performance']
-        name = data['name']
-        
-        label = f"{stock} ({name})"
-        label_padding = max_label_width - str_display_width(label)
-        
-        bar_length = int((abs(performance_val) / max_combined_performance) * max_bar_width)
-        
-        bar_char = '*'
-        if performance_val < 0:
-            bar_char = '-' # Use a different char for negative performance, or direction
-        
-        bar = bar_char * bar_length
-        
-        print(f"{label}{' ' * label_padding}                             | {bar} {performance_val:+.2f}%") # Use + to show sign for positive numbers
-        
-    print("==========================================================")
-
-def generate_subtracted_performance_chart(summary, year):
-    """Generates a bar chart for yield rate minus price change."""
+    # Find the stock code first
+    for part in parts:
+        if '.' in part and (part.endswith('.TW') or part.endswith('.TWO')):
+            identified_stock_code = part
+            break
     
-    print(f"\n=== Yield Rate minus Price Change Rate Chart ({year}) ===")
-                  
-    chart_data = {}
-    max_subtracted_performance = 0.0
-    for stock, (total, name, price, price_date, shares, price_change, _, _, _, _) in summary.items(): # Added placeholders
-        yield_val = 0.0
-        if total > 0 and price is not None and price > 0:
-            yield_val = (total / price) * 100
-        
-        # Only include stocks that have a positive yield
-        if yield_val > 0:
-            subtracted_performance = None
-            if price_change is not None:
-                subtracted_performance = yield_val - price_change
-            
-            if subtracted_performance is not None:
-                chart_data[stock] = {"performance": subtracted_performance, "name": name}
-                if abs(subtracted_performance) > max_subtracted_performance:
-                    max_subtracted_performance = abs(subtracted_performance)
-
-    if not chart_data or max_subtracted_performance == 0:
-        print("No data available to generate a chart.")
-        print("=============================================================")
-        return
+    if not identified_stock_code:
+        return None
 
-    max_label_width = 0
-    for stock, data in chart_data.items():
-        label = f"{stock} ({data['name']})"
-        max_label_width = max(max_label_width, str_display_width(label))
+    # Process all other parts
+    name_parts = []
+    numeric_parts = []
+    for part in parts:
+        if part == identified_stock_code:
+            continue
+        part = part.replace(',', '').strip()
+        if not part: continue
 
-    max_bar_width = 50
+        try:
+            numeric_parts.append(float(part))
+        except ValueError:
+            name_parts.append(part)
+
+    name = ' '.join(name_parts).replace('"', '') if name_parts else None
+
+    # Correctly assign numeric parts
+    shares_val, bought_price_val, thresh1, thresh2 = None, None, None, None
+    temp_numerics = list(numeric_parts)
+
+    # Find shares (must be an integer, assumes one per line)
+    for num in temp_numerics:
+        if num == int(num):
+            shares_val = int(num)
+            temp_numerics.remove(num)
+            break
     
-    sorted_stocks = sorted(chart_data.items(), key=lambda item: item[1]['performance'], reverse=True)
-
-    for stock, data in sorted_stocks:
-        performance_val = data['performance']
-        name = data['name']
-        
-        label = f"{stock} ({name})"
-        label_padding = max_label_width - str_display_width(label)
-        
-        bar_length = int((abs(performance_val) / max_subtracted_performance) * max_bar_width)
-        
-        bar_char = '~'
-        if performance_val < 0:
-            bar_char = '-'
-        
-        bar = bar_char * bar_length
-        
-        print(f"{label}{' ' * label_padding}                             | {bar} {performance_val:+.2f}%")
-        
-    print("==========================================================")
+    # Assign remaining floats
+    if temp_numerics: bought_price_val = temp_numerics.pop(0)
+    if temp_numerics: thresh1 = temp_numerics.pop(0)
+    if temp_numerics: thresh2 = temp_numerics.pop(0)
+
+    # Correctly assign high and low thresholds
+    low_rate_threshold, high_rate_threshold = None, None
+    if thresh1 is not None and thresh2 is not None:
+        high_rate_threshold = max(thresh1, thresh2)
+        low_rate_threshold = min(thresh1, thresh2)
+    elif thresh1 is not None:
+        if thresh1 > 0: high_rate_threshold = thresh1
+        else: low_rate_threshold = thresh1
+
+    return identified_stock_code, name, shares_val, bought_price_val, low_rate_threshold, high_rate_threshold
+
+def iter_portfolio(lines, log=print):
+    """Yields the parsed position of every stock line, one line at a time."""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
 
-def main(args):
-    year = args.year
-    stock_list_from_args = args.stocks 
-    input_file_path = args.input_file
-
-    summary = {} # Initialize summary here
-    final_stock_codes_to_process = []
-    stock_names_from_input_file = {}
-    shares_map = {}
-    bought_price_map = {}
-    low_rate_threshold_map = {} # Renamed for clarity
-    high_rate_threshold_map = {} # Renamed for clarity
-
-    # Load master Chinese names from the local file (stock_list.txt)
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    master_stock_name_file = os.path.join(script_dir, 'stock_list.txt')
-    master_stock_names_map = load_stock_names(master_stock_name_file)
-
-    if input_file_path:
-        # If an input file is provided, read codes from it
+        position = parse_portfolio_line(line)
+        if position is None:
+            log(f"Warning: Skipping line in input file, no valid stock code found: {line}")
+            continue
+        yield position
+
+@dataclass(frozen=True)
+class Portfolio:
+    """
+    A portfolio file parsed once: `positions` holds its parse_portfolio_line() tuples in file
+    order and `warnings` the lines that were skipped. `id` is the SHA-256 of the file content.
+    """
+    id: str
+    name: str
+    positions: tuple
+    warnings: tuple
+
+def parse_portfolio(content, name=None):
+    """
+    Parses the bytes of a portfolio file into a Portfolio, with the same rules as -i.
+    Raises ValueError if the content is not UTF-8 text or holds no valid stock line.
+    """
+    try:
+        text = content.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Portfolio file is not UTF-8 text: {e}")
+
+    warnings = []
+    positions = tuple(iter_portfolio(text.splitlines(), warnings.append))
+    if not positions:
+        raise ValueError("No valid stock code found in the portfolio file (e.g. 2330.TW or 00772B.TWO).")
+    return Portfolio(hashlib.sha256(content).hexdigest(), name, positions, tuple(warnings))
+
+class RowSpool:
+    """
+    An append-only sink for JSON rows backed by a temporary file, so a long portfolio's
+    rows do not have to stay in memory until the JSON block is printed.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        self._count = 0
+
+    def append(self, row):
+        self._file.write(json.dumps(row) + "\n")
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def encoded(self):
+        """Yields the rows as JSON strings in the order they were appended."""
+        self._file.flush()
+        self._file.seek(0)
+        for line in self._file:
+            yield line.rstrip("\n")
+        self._file.seek(0, os.SEEK_END)
+
+    def __iter__(self):
+        for encoded_row in self.encoded():
+            yield json.loads(encoded_row)
+
+    def close(self):
+        self._file.close()
+
+def collect_dividends(years, stock_codes=None, input_file=None, workers=8, cache=None, log=print, on_row=None,
+                      rows=None, compact=False, fetches=None, quote_batch=QUOTE_BATCH_SIZE, portfolio=None):
+    """
+    Collects dividends, latest prices and yearly price changes for the given stock codes,
+    for the stocks listed in a portfolio input file or for an already parsed Portfolio.
+    Progress and warnings go to log(), and on_row() receives each stock's JSON row as soon
+    as that stock is done.
+
+    The input is parsed, fetched and summarized as a stream: at most a few stocks per worker
+    are in flight, and each finished stock is logged and its JSON row appended to `rows`
+    (a new list by default, or e.g. a RowSpool) in input order. With compact=True the kept
+    summaries drop their dividend events, which only the JSON rows need. `fetches` is an
+    optional {stock code: Future} dict shared between runs, so each stock is fetched once.
+    Cached stocks whose price expired get it from batched quote requests of quote_batch symbols.
+
+    Returns a dict with "years", "year_label", "summary" (the whole period),
+    "yearly_summaries", their PortfolioMetrics ("metrics", "yearly_metrics"), "json_data" and "totals", or None if the input file cannot be read.
+    """
+    year_label = format_year_label(years)
+    summary = {} # Initialize summary here (the whole period)
+    yearly_summaries = {year: {} for year in years}
+    json_data = rows if rows is not None else []
+
+    # Master Chinese names (stock_list.txt) are looked up in its index per requested stock
+    master_names = open_master_names()
+
+    input_handle = None
+    if input_file:
+        # If an input file is provided, read codes from it line by line
         try:
-            with open(input_file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#'):
-                        continue
-                    
-                    parts = line.replace('　', ' ').split()
-                    identified_stock_code = None
-                    
-                    # Find the stock code first
-                    for part in parts:
-                        if '.' in part and (part.endswith('.TW') or part.endswith('.TWO')):
-                            identified_stock_code = part
-                            break
-                    
-                    if identified_stock_code:
-                        final_stock_codes_to_process.append(identified_stock_code)
-                        
-                        # Process all other parts
-                        name_parts = []
-                        numeric_parts = []
-                        for part in parts:
-                            if part == identified_stock_code:
-                                continue
-                            part = part.replace(',', '').strip()
-                            if not part: continue
-
-                            try:
-                                numeric_parts.append(float(part))
-                            except ValueError:
-                                name_parts.append(part)
-
-                        if name_parts:
-                            stock_names_from_input_file[identified_stock_code] = ' '.join(name_parts).replace('"', '')
-
-                        # Correctly assign numeric parts
-                        shares_val, bought_price_val, thresh1, thresh2 = None, None, None, None
-                        temp_numerics = list(numeric_parts)
-
-                        # Find shares (must be an integer, assumes one per line)
-                        for num in temp_numerics:
-                            if num == int(num):
-                                shares_val = int(num)
-                                temp_numerics.remove(num)
-                                break
-                        
-                        # Assign remaining floats
-                        if temp_numerics: bought_price_val = temp_numerics.pop(0)
-                        if temp_numerics: thresh1 = temp_numerics.pop(0)
-                        if temp_numerics: thresh2 = temp_numerics.pop(0)
-
-                        if shares_val is not None: shares_map[identified_stock_code] = shares_val
-                        if bought_price_val is not None: bought_price_map[identified_stock_code] = bought_price_val
-                        
-                        # Correctly assign high and low thresholds
-                        if thresh1 is not None and thresh2 is not None:
-                            high_rate_threshold_map[identified_stock_code] = max(thresh1, thresh2)
-                            low_rate_threshold_map[identified_stock_code] = min(thresh1, thresh2)
-                        elif thresh1 is not None:
-                            if thresh1 > 0: high_rate_threshold_map[identified_stock_code] = thresh1
-                            else: low_rate_threshold_map[identified_stock_code] = thresh1
-                    else:
-                        print(f"Warning: Skipping line in input file, no valid stock code found: {line}")
-                        
+            input_handle = open(input_file, 'r', encoding='utf-8')
         except FileNotFoundError:
-            print(f"Error: Input file not found: {input_file_path}")
-            return
+            log(f"Error: Input file not found: {input_file}")
+            return None
         except Exception as e:
-            print(f"Error reading input file {input_file_path}: {e}")
-            return
-    elif stock_list_from_args:
-        final_stock_codes_to_process = stock_list_from_args
-    
-    final_stock_names_map = master_stock_names_map.copy()
-    final_stock_names_map.update(stock_names_from_input_file)
+            log(f"Error reading input file {input_file}: {e}")
+            return None
+        positions = iter_portfolio(input_handle, log)
+    elif portfolio is not None:
+        for warning in portfolio.warnings:
+            log(warning)
+        positions = iter(portfolio.positions)
+    else:
+        positions = ((stock_code, None, None, None, None, None) for stock_code in stock_codes or [])
+
+    def record_stock(stock_code, yearly_records, period_record, row):
+        """The in-order sink: logs the stock and keeps what the report needs."""
+        log(f"Processing {stock_code}...")
+        chinese_name = period_record.name
+        for year, record in yearly_records.items():
+            total, dividends = record.total, record.dividends
+
+            if dividends:
+                log(f"\nDividend info for stock {stock_code} ({chinese_name}) in {year}:")
+                for d in dividends:
+                    log(f"Date: {d['Date']}, Cash Dividend: {d['Amount']:.2f}")
+                log(f"Total Dividend for {stock_code} in {year}: {total:.2f}\n")
+            else:
+                log(f"No dividend info found for stock {stock_code} in {year}.")
+
+            yearly_summaries[year][stock_code] = replace(record, dividends=[]) if compact else record
+
+        summary[stock_code] = replace(period_record, dividends=[]) if compact else period_record
+        json_data.append(row)
+
+    # Fetch concurrently within a bounded window. Rows are reported in completion order
+    # through on_row, while the log and the summaries are filled in the original input order.
+    window = max(1, workers) * 4
+    refill = max(1, window // 2)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            pending = {}   # future -> [(index, position)], one future per distinct stock
+            completed = {} # index -> finished stock, waiting for its predecessors
+            submitted = 0
+            next_index = 0
+            exhausted = False
+
+            while True:
+                # Never run further ahead of the oldest unfinished stock than the window. New stocks
+                # are read in blocks, so their expired quotes can be refreshed in batched requests.
+                free = next_index + window - submitted
+                if not exhausted and (free >= refill or not pending):
+                    try:
+                        block = list(islice(positions, free))
+                    except (OSError, UnicodeDecodeError) as e:
+                        log(f"Error reading input file {input_file}: {e}")
+                        executor.shutdown(cancel_futures=True)
+                        return None
+                    exhausted = len(block) < free
+
+                    cached, unquoted = {}, set()
+                    if cache is not None and quote_batch > 1:
+                        new_codes = [position[0] for position in block if '.' in position[0] and not (fetches and position[0] in fetches)]
+                        cached, unquoted = prefetch_quotes(cache, new_codes, years, quote_batch, log, executor)
+
+                    for position in block:
+                        stock_code = position[0]
+                        if '.' not in stock_code:
+                            completed[submitted] = (stock_code, None)
+                        else:
+                            future = fetches.get(stock_code) if fetches is not None else None
+                            if future is None:
+                                future = executor.submit(
+                                    fetch_stock_data, stock_code, years, cache, log, cached.get(stock_code), stock_code in unquoted
+                                )
+                                if fetches is not None:
+                                    fetches[stock_code] = future
+                            pending.setdefault(future, []).append((submitted, position))
+                        submitted += 1
+
+                if pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for index, (stock_code, file_name, *holding) in pending.pop(future):
+                            if file_name is not None:
+                                name = file_name
+                            elif master_names is not None:
+                                name = master_names.get(stock_code, "N/A")
+                            else:
+                                name = "N/A"
+                            yearly_records, period_record = summarize_stock(future.result(), years, name, *holding)
+                            instrumentation.increment("symbols_processed_total")
+                            row = build_stock_json_row(stock_code, period_record, yearly_records, year_label)
+                            completed[index] = (stock_code, (yearly_records, period_record, row))
+                            if on_row is not None:
+                                on_row(row)
+
+                while next_index in completed:
+                    stock_code, finished = completed.pop(next_index)
+                    next_index += 1
+                    if finished is None:
+                        log(f"Processing {stock_code}...")
+                        log(f"Invalid format: {stock_code}. Must include '.' like 2330.TW or 00772B.TWO")
+                    else:
+                        record_stock(stock_code, *finished)
+
+                if exhausted and not pending and not completed:
+                    break
+    finally:
+        if input_handle is not None:
+            input_handle.close()
+
+    # Derive every metric once per period, column-wise over all stocks
+    metrics = PortfolioMetrics(summary)
+    yearly_metrics = {year: PortfolioMetrics(yearly_summaries[year]) for year in years}
+
+    return {
+        "years": years,
+        "year_label": year_label,
+        "summary": summary,
+        "yearly_summaries": yearly_summaries,
+        "metrics": metrics,
+        "yearly_metrics": yearly_metrics,
+        "json_data": json_data,
+        "totals": metrics.totals()
+    }
+
+def expand_input_files(paths):
+    """
+    Expands the -i arguments into portfolio files: files are kept as given, a directory
+    contributes its *.txt files in name order. Duplicates are dropped.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith('.txt') and not name.startswith('.')
+            )
+        else:
+            candidates = [path]
+        for candidate in candidates:
+            if candidate not in files:
+                files.append(candidate)
+    return files
 
-    for stock_code in final_stock_codes_to_process:
-        print(f"Processing {stock_code}...")
-        if '.' not in stock_code:
-            print(f"Invalid format: {stock_code}. Must include '.' like 2330.TW or 00772B.TWO")
+def combine_holdings(records):
+    """
+    Merges one stock's StockSummary records from several portfolios into one household
+    holding: the shares are added up and the bought price becomes the share-weighted
+    average cost. The name and the thresholds are taken from the first portfolio that has them.
+    Returns (name, shares, bought_price, low_rate_threshold, high_rate_threshold).
+    """
+    name = next((record.name for record in records if record.name and record.name != "N/A"), records[0].name)
+    shares = None
+    cost, cost_shares = 0.0, 0
+    for record in records:
+        if record.shares is not None:
+            shares = (shares or 0) + record.shares
+            if record.bought_price is not None:
+                cost += record.shares * record.bought_price
+                cost_shares += record.shares
+
+    if cost_shares:
+        bought_price = cost / cost_shares
+    else:
+        bought_price = next((record.bought_price for record in records if record.bought_price is not None), None)
+    low_rate_threshold = next((record.low_rate_threshold for record in records if record.low_rate_threshold is not None), None)
+    high_rate_threshold = next((record.high_rate_threshold for record in records if record.high_rate_threshold is not None), None)
+    return name, shares, bought_price, low_rate_threshold, high_rate_threshold
+
+def collect_portfolios(years, input_files, workers=8, cache=None, log=print, on_row=None, rows=None, compact=False,
+                       quote_batch=QUOTE_BATCH_SIZE):
+    """
+    Collects several portfolio files in one batch. Every distinct stock is fetched once,
+    however many portfolios hold it. Each portfolio gets its own collect_dividends() result,
+    and the household view combines the holdings of all of them (see combine_holdings()).
+
+    Returns the household result, shaped like a collect_dividends() result, with an extra
+    "portfolios" list of {"name": file, "result": result}, or None if a file cannot be read.
+    on_row() and `rows` receive the household rows; each carries the files holding the stock.
+    """
+    fetches = {} # stock code -> Future of its fetch_stock_data() result
+    portfolios = []
+    for input_file in input_files:
+        log(f"\n##### Portfolio: {input_file} #####")
+        # A compact run only prints the household rows, so the per-portfolio rows are dropped
+        portfolio_rows = deque(maxlen=0) if compact else None
+        result = collect_dividends(
+            years, None, input_file, workers, cache, log,
+            rows=portfolio_rows, compact=compact, fetches=fetches, quote_batch=quote_batch
+        )
+        if result is None:
+            return None
+        portfolios.append({"name": input_file, "result": result})
+
+    # Household holdings in first-seen order: stock code -> (records, portfolio names)
+    holdings = {}
+    for portfolio in portfolios:
+        for stock_code, record in portfolio["result"]["summary"].items():
+            records, names = holdings.setdefault(stock_code, ([], []))
+            records.append(record)
+            names.append(portfolio["name"])
+
+    year_label = format_year_label(years)
+    summary = {}
+    yearly_summaries = {year: {} for year in years}
+    json_data = rows if rows is not None else []
+    for stock_code, (records, names) in holdings.items():
+        yearly_records, period_record = summarize_stock(fetches[stock_code].result(), years, *combine_holdings(records))
+        row = build_stock_json_row(stock_code, period_record, yearly_records, year_label)
+        row["portfolios"] = names
+        json_data.append(row)
+        if on_row is not None:
+            on_row(row)
+
+        for year, record in yearly_records.items():
+            yearly_summaries[year][stock_code] = replace(record, dividends=[]) if compact else record
+        summary[stock_code] = replace(period_record, dividends=[]) if compact else period_record
+
+    log(f"\nHousehold: {len(holdings)} distinct stocks in {len(portfolios)} portfolios, {len(fetches)} fetched.")
+
+    metrics = PortfolioMetrics(summary)
+    return {
+        "years": years,
+        "year_label": year_label,
+        "summary": summary,
+        "yearly_summaries": yearly_summaries,
+        "metrics": metrics,
+        "yearly_metrics": {year: PortfolioMetrics(yearly_summaries[year]) for year in years},
+        "json_data": json_data,
+        "totals": metrics.totals(),
+        "portfolios": portfolios
+    }
+
+def collect(args, cache=None, log=print, on_row=None, rows=None, compact=False):
+    """
+    Runs collect_dividends(), or collect_portfolios() when -i names several files or a directory.
+    args.portfolio, a Portfolio parsed by the web app, takes the place of -i and -s.
+    """
+    if args.portfolio is not None:
+        return collect_dividends(args.year, None, None, args.workers, cache, log, on_row, rows, compact,
+                                 quote_batch=args.quote_batch, portfolio=args.portfolio)
+    if args.input_file:
+        input_files = expand_input_files(args.input_file)
+        if not input_files:
+            log(f"Error: No portfolio files found in: {' '.join(args.input_file)}")
+            return None
+        if len(input_files) > 1 or os.path.isdir(args.input_file[0]):
+            return collect_portfolios(args.year, input_files, args.workers, cache, log, on_row, rows, compact, args.quote_batch)
+        return collect_dividends(args.year, None, input_files[0], args.workers, cache, log, on_row, rows, compact,
+                                 quote_batch=args.quote_batch)
+    return collect_dividends(args.year, args.stocks, None, args.workers, cache, log, on_row, rows, compact,
+                             quote_batch=args.quote_batch)
+
+def write_json_array(rows, out=None):
+    """Writes rows as one JSON array line, row by row, like print(json.dumps(rows)) would."""
+    out = out if out is not None else sys.stdout
+    encoded = rows.encoded() if isinstance(rows, RowSpool) else (json.dumps(row) for row in rows)
+    out.write("[")
+    for index, encoded_row in enumerate(encoded):
+        if index:
+            out.write(", ")
+        out.write(encoded_row)
+    out.write("]\n")
+
+def render_periods(result, lines):
+    """Appends the summary tables and charts of every year of a result, then of the whole period."""
+    years = result["years"]
+    if len(years) > 1:
+        for year in years:
+            render_summary_report(result["yearly_metrics"][year], year, lines)
+    render_summary_report(result["metrics"], result["year_label"], lines)
+
+@instrumentation.timed("report")
+def print_report(result, out=None, include_json=True):
+    """Prints the summary tables, the charts and the JSON block of a collect_dividends() result."""
+    if not result["summary"]:
+        return
+
+    # The tables and charts of every period are rendered into one buffer and written at once
+    lines = []
+    if "portfolios" in result:
+        for portfolio in result["portfolios"]:
+            lines.append(f"\n##### Portfolio: {portfolio['name']} #####")
+            render_periods(portfolio["result"], lines)
+        lines.append(f"\n##### Household ({len(result['portfolios'])} portfolios) #####")
+    render_periods(result, lines)
+
+    if include_json:
+        # --- JSON Output for Web Interface ---
+        lines.append("\n---JSON_START---")
+    write_text(lines, out)
+    if not include_json:
+        return
+
+    # The rows are streamed, they may be spooled on disk
+    write_json_array(result["json_data"], out)
+    print("---JSON_END---", file=out)
+
+def fetch_daily_history(stock_code_with_suffix, start, end, cache=None, log=print, year_buckets=None):
+    """
+    Loads the daily closes and the dividend events of one stock from start to end (datetime.date):
+    from the local price store and the cached year buckets (`year_buckets`, looked up by the caller),
+    or from one chart download when they are not cached.
+    Returns (day ordinals, closes, [(ex-day ordinal, amount)]) for price_store.build_history_matrix().
+    """
+    years = range(start.year, end.year + 1)
+    if cache is not None and year_buckets is not None and is_stale(cache.prices, stock_code_with_suffix, end, PRICE_SYNC_AGE):
+        synced = sync_cached_stock(cache, stock_code_with_suffix, log)
+        year_buckets = None if synced is None else {**year_buckets, **synced[1]}
+    if cache is None or year_buckets is None:
+        chart = fetch_chart_yahoo(stock_code_with_suffix, log)
+        if cache is not None and chart is not None:
+            cache_chart(cache, stock_code_with_suffix, chart)
+        year_buckets = bucket_chart_by_year(chart)
+
+    if cache is None:
+        days, closes = chart_closes(chart)
+        inside = (days >= start.toordinal()) & (days <= end.toordinal())
+        days, closes = days[inside], closes[inside]
+    else:
+        days, closes = cache.prices.closes(stock_code_with_suffix, start, end)
+
+    dividends = []
+    for year in years:
+        for dividend in year_buckets.get(year, _empty_year_bucket())["dividends"]:
+            day = datetime.date.fromisoformat(dividend["Date"])
+            if start <= day <= end:
+                dividends.append((day.toordinal(), dividend["Amount"]))
+    return days, closes, dividends
+
+def load_history_matrix(stock_codes, start, end, workers=8, cache=None, log=print):
+    """
+    Loads the daily histories of several stocks and aligns them, see price_store.build_history_matrix().
+    Cached stocks are read locally; the others are downloaded concurrently.
+    """
+    cached = {}
+    if cache is not None:
+        years = list(range(start.year, end.year + 1))
+        cached = {stock_code: year_buckets for stock_code, (_, year_buckets) in load_cached_stocks(cache, stock_codes, years).items()}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        histories = list(executor.map(
+            lambda stock_code: fetch_daily_history(stock_code, start, end, cache, log, cached.get(stock_code)), stock_codes
+        ))
+    return build_history_matrix(histories)
+
+def _backtest_totals(rows):
+    """Adds up the trades of a backtest period."""
+    return {
+        "trades": sum(1 for row in rows if row["outcome"] != "No Data"),
+        "take_profit": sum(1 for row in rows if row["outcome"] == "Take-Profit"),
+        "cut_loss": sum(1 for row in rows if row["outcome"] == "Cut-Loss"),
+        "realized_pl": sum(row["realized_pl"] or 0.0 for row in rows),
+        "dividend_income": sum(row["dividend_income"] or 0.0 for row in rows)
+    }
+
+def backtest_portfolio(result, workers=8, cache=None, log=print):
+    """
+    Backtests the Take-Profit/Cut-Loss thresholds of every position in a collect_dividends()
+    result over its years: each year a position buys at the first close and sells when a
+    threshold is reached or at the last close (see backtest.py). A household result
+    backtests each portfolio's own positions.
+    Returns {"years", "rows": {year: [trade row]}, "totals": {year: totals, "period": totals}, "portfolios"}.
+    """
+    years = result["years"]
+    portfolios = result.get("portfolios") or [{"name": None, "result": result}]
+    positions = [
+        (portfolio["name"], stock_code, record)
+        for portfolio in portfolios for stock_code, record in portfolio["result"]["summary"].items()
+    ]
+    stock_codes = list(dict.fromkeys(stock_code for _, stock_code, _ in positions))
+    days, closes, dividends = load_history_matrix(
+        stock_codes, datetime.date(years[0], 1, 1), datetime.date(years[-1], 12, 31), workers, cache, log
+    )
+
+    records = [record for _, _, record in positions]
+    stock_rows = {stock_code: row for row, stock_code in enumerate(stock_codes)}
+    with instrumentation.timed("backtest"):
+        trades_by_year = run_backtest(
+            days, closes, dividends, [stock_rows[stock_code] for _, stock_code, _ in positions],
+            _column(records, 'low_rate_threshold'), _column(records, 'high_rate_threshold'), years
+        )
+
+    shares = _column(records, 'shares')
+    rows_by_year = {}
+    for year, trades in trades_by_year.items():
+        entry_price, exit_price, dividends_per_share = trades["entry_price"], trades["exit_price"], trades["dividends"]
+        # Positions without shares have per-share figures only
+        realized_pl = (exit_price - entry_price) * shares
+        dividend_income = dividends_per_share * shares
+        return_pct = (exit_price - entry_price + dividends_per_share) / entry_price * 100
+
+        columns = zip(
+            positions, trades["outcome"].tolist(), trades["entry_day"], _as_optional_list(entry_price),
+            trades["exit_day"], _as_optional_list(exit_price), dividends_per_share.tolist(),
+            _as_optional_list(realized_pl), _as_optional_list(dividend_income), _as_optional_list(return_pct)
+        )
+        rows = []
+        for (portfolio, stock_code, record), outcome, entry_day, entry, exit_day, exit, per_share, pl, income, percent in columns:
+            rows.append({
+                "portfolio": portfolio,
+                "stock": stock_code,
+                "name": record.name,
+                "year": year,
+                "outcome": OUTCOME_LABELS[outcome],
+                "entry_date": entry_day.isoformat() if entry_day else None,
+                "entry_price": entry,
+                "exit_date": exit_day.isoformat() if exit_day else None,
+                "exit_price": exit,
+                "dividends": per_share,
+                "shares": record.shares,
+                "realized_pl": pl,
+                "dividend_income": income,
+                "return_pct": percent
+            })
+        rows_by_year[year] = rows
+
+    totals = {year: _backtest_totals(rows) for year, rows in rows_by_year.items()}
+    totals["period"] = _backtest_totals([row for rows in rows_by_year.values() for row in rows])
+    return {"years": years, "rows": rows_by_year, "totals": totals, "portfolios": "portfolios" in result}
+
+# Backtest table columns: (key, header, right-aligned)
+BACKTEST_COLUMNS = [
+    ("stock", "Stock", False), ("name", "Name", False), ("bought", "Bought", False), ("sold", "Sold", False),
+    ("outcome", "Exit", False), ("dividends", "Dividends", True), ("shares", "Shares", True),
+    ("realized_pl", "Realized P/L", True), ("dividend_income", "Dividend Income", True), ("return_pct", "Return %", True)
+]
+
+def _format_trade_day(day, price):
+    return "N/A" if day is None else f"{day} {price:.2f}"
+
+def render_backtest_report(backtest, lines):
+    """Appends one table of threshold trades per year and the totals of the backtest to lines."""
+    columns = BACKTEST_COLUMNS
+    if backtest["portfolios"]:
+        columns = [("portfolio", "Portfolio", False)] + columns
+    headers = {key: header for key, header, _ in columns}
+
+    for year, rows in backtest["rows"].items():
+        lines.append(f"\n=== Threshold Backtest ({year}) ===")
+        if not rows:
+            lines.append("No positions to backtest.")
             continue
-        
-        chinese_name = final_stock_names_map.get(stock_code, "N/A")
-        shares = shares_map.get(stock_code)
-        bought_price = bought_price_map.get(stock_code)
-        low_rate_threshold = low_rate_threshold_map.get(stock_code)
-        high_rate_threshold = high_rate_threshold_map.get(stock_code)
-        
-        dividends, total = fetch_dividend_yahoo(stock_code, year)
-        price, price_date = get_latest_price_yahoo(stock_code)
-        price_change = get_price_change_yahoo(stock_code, year)
-        
-        summary[stock_code] = (total, chinese_name, price, price_date, shares, price_change, bought_price, low_rate_threshold, high_rate_threshold, dividends)
-
-        if dividends:
-            print(f"\nDividend info for stock {stock_code} ({chinese_name}) in {year}:")
-            for d in dividends:
-                print(f"Date: {d['Date']}, Cash Dividend: {d['Amount']:.2f}")
-            print(f"Total Dividend for {stock_code} in {year}: {total:.2f}\n")
-
-    if summary:
-        print(f"\n=== Dividend Summary ({year}) ===")
-                    
-        price_header_date = ""
-        # Update unpacking to ignore the new last element (dividends)
-        for _, _, _, p_date, _, _, _, _, _, _ in summary.values():
-            if p_date and p_date != "N/A":
-                price_header_date = p_date
-                break
-        
-        price_header_text = f"Price ({price_header_date})" if price_header_date else "Price"
-
-        header_data = {
-            "stock": "Stock", "name": "Name", "price": price_header_text, 
-            "dividend": "Dividend", "yield": "Yield", "shares": "Shares", 
-            "total_value": "Total Value", "net_pl": "P/L", "percent_pl": "P/L %",
-            "signal": "Signal"
+        cells = {
+            "portfolio": [row["portfolio"] or "" for row in rows],
+            "stock": [row["stock"] for row in rows],
+            "name": [row["name"] for row in rows],
+            "bought": [_format_trade_day(row["entry_date"], row["entry_price"]) for row in rows],
+            "sold": [_format_trade_day(row["exit_date"], row["exit_price"]) for row in rows],
+            "outcome": [row["outcome"] for row in rows],
+            "dividends": [f"{row['dividends']:.2f}" for row in rows],
+            "shares": _format_optional([row["shares"] for row in rows], "{}", ""),
+            "realized_pl": _format_optional([row["realized_pl"] for row in rows], "{:,.2f}", "N/A"),
+            "dividend_income": _format_optional([row["dividend_income"] for row in rows], "{:,.2f}", "N/A"),
+            "return_pct": _format_optional([row["return_pct"] for row in rows], "{:+.2f}%", "N/A")
         }
-        print_data = [header_data]
-        
-        max_widths = {key: str_display_width(value) for key, value in header_data.items()}
-
-        for stock, (total, name, price, price_date, shares, price_change, bought_price, low_rate_threshold, high_rate_threshold, dividends_list) in summary.items():
-            price_str = f"{price:.2f}" if price is not None else "N/A"
-            dividend_str = f"{total:.2f}"
-            yield_str = "N/A"
-            if total > 0 and price is not None and price > 0:
-                yield_val = (total / price) * 100
-                yield_str = f"{yield_val:.2f}%"
-
-            shares_str = str(shares) if shares is not None else ""
-            total_value_str = ""
-            if total > 0 and shares is not None:
-                total_value = total * shares
-                total_value_str = f"{total_value:,.2f}"
-
-            net_pl_str = "N/A"
-            percent_pl_str = "N/A"
-            percent_pl = None
-            if bought_price is not None and price is not None and shares is not None:
-                net_pl = (price - bought_price) * shares
-                net_pl_str = f"{net_pl:,.2f}"
-                if bought_price > 0:
-                    percent_pl = ((price - bought_price) / bought_price) * 100
-                    percent_pl_str = f"{percent_pl:+.2f}%"
-            
-            signal_str = ""
-            if percent_pl is not None:
-                if high_rate_threshold is not None and percent_pl >= high_rate_threshold:
-                    signal_str = "Take-Profit"
-                elif low_rate_threshold is not None and percent_pl <= low_rate_threshold:
-                    signal_str = "Cut-Loss"
-
-            row = {
-                "stock": stock, "name": name, "price": price_str, "dividend": dividend_str, 
-                "yield": yield_str, "shares": shares_str, "total_value": total_value_str,
-                "net_pl": net_pl_str, "percent_pl": percent_pl_str, "signal": signal_str
-            }
-            print_data.append(row)
-
-            for key, value in row.items():
-                max_widths[key] = max(max_widths.get(key, 0), str_display_width(str(value)))
-
-        header_line = (
-            f"{header_data['stock']:<{max_widths['stock']}}  "
-            f"{header_data['name']:<{max_widths['name']}}  "
-            f"{header_data['price']:>{max_widths['price']}}  "
-            f"{header_data['dividend']:>{max_widths['dividend']}}  "
-            f"{header_data['yield']:>{max_widths['yield']}}  "
-            f"{header_data['shares']:>{max_widths['shares']}}  "
-            f"{header_data['total_value']:>{max_widths['total_value']}}  "
-            f"{header_data['net_pl']:>{max_widths['net_pl']}}  "
-            f"{header_data['percent_pl']:>{max_widths['percent_pl']}}  "
-            f"{header_data['signal']:<{max_widths['signal']}}"
+        render_table(columns, headers, cells, lines)
+        totals = backtest["totals"][year]
+        lines.append(
+            f"Trades: {totals['trades']}, Take-Profit: {totals['take_profit']}, Cut-Loss: {totals['cut_loss']}, "
+            f"Realized P/L: {totals['realized_pl']:,.2f}, Dividend Income: {totals['dividend_income']:,.2f}"
         )
-        print(header_line)
-        print("-" * str_display_width(header_line))
-
-        for row in print_data[1:]:
-            stock_padding = max_widths['stock'] - str_display_width(row['stock'])
-            name_padding = max_widths['name'] - str_display_width(row['name'])
-            
-            line = (
-                f"{row['stock']}{' ' * stock_padding}  "
-                f"{row['name']}{' ' * name_padding}  "
-                f"{row['price']:>{max_widths['price']}}  "
-                f"{row['dividend']:>{max_widths['dividend']}}  "
-                f"{row['yield']:>{max_widths['yield']}}  "
-                f"{row['shares']:>{max_widths['shares']}}  "
-                f"{row['total_value']:>{max_widths['total_value']}}  "
-                f"{row['net_pl']:>{max_widths['net_pl']}}  "
-                f"{row['percent_pl']:>{max_widths['percent_pl']}}  "
-                f"{row['signal']:<{max_widths['signal']}}"
+        lines.append("===================================================================================")
+
+    if len(backtest["years"]) > 1:
+        totals = backtest["totals"]["period"]
+        lines.append(f"\n=== Threshold Backtest Total ({format_year_label(backtest['years'])}) ===")
+        lines.append(
+            f"Trades: {totals['trades']}, Take-Profit: {totals['take_profit']}, Cut-Loss: {totals['cut_loss']}, "
+            f"Realized P/L: {totals['realized_pl']:,.2f}, Dividend Income: {totals['dividend_income']:,.2f}"
+        )
+
+def print_backtest_report(backtest, out=None):
+    """Prints the threshold backtest tables."""
+    lines = []
+    render_backtest_report(backtest, lines)
+    write_text(lines, out)
+
+def parse_date_range(value):
+    """Parses a --total-return range "YYYY-MM-DD:YYYY-MM-DD". Returns (start, end) as datetime.date."""
+    try:
+        start, end = (datetime.date.fromisoformat(part) for part in value.split(':', 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date range: {value} (use e.g. 2023-03-01:2024-02-29)")
+
+    if start > end:
+        raise argparse.ArgumentTypeError(f"Invalid date range: {value} (start date is after end date)")
+    return start, end
+
+def total_return_periods(years, date_range=None):
+    """The (label, start, end) periods of --total-return: the given range, or each year and the whole period."""
+    if date_range is not None:
+        start, end = date_range
+        return [(f"{start}:{end}", start, end)]
+    periods = [(str(year), datetime.date(year, 1, 1), datetime.date(year, 12, 31)) for year in years]
+    if len(years) > 1:
+        periods.append((format_year_label(years), datetime.date(years[0], 1, 1), datetime.date(years[-1], 12, 31)))
+    return periods
+
+def compute_total_returns(result, periods, workers=8, cache=None, log=print):
+    """
+    Computes the holding return of every stock in a collect_dividends() result, and of the
+    portfolio for the shares held, over each (label, start, end) period: price only, with
+    dividends kept as cash and with dividends reinvested on their ex-days (see total_return.py).
+    A household result is computed for the combined holdings.
+    Returns a list of {"period", "start", "end", "rows", "portfolio"}; returns are in %.
+    """
+    summary = result["summary"]
+    stock_codes = list(summary)
+    start = min(period_start for _, period_start, _ in periods)
+    end = max(period_end for _, _, period_end in periods)
+    days, closes, dividends = load_history_matrix(stock_codes, start, end, workers, cache, log)
+
+    with instrumentation.timed("total_return"):
+        index = ReturnIndex(days, closes, dividends)
+        shares = _column(summary.values(), 'shares')
+        computed = []
+        for label, period_start, period_end in periods:
+            returns = index.holding_returns(period_start.toordinal(), period_end.toordinal())
+            columns = zip(
+                stock_codes, returns["first"].tolist(), _as_optional_list(returns["first_close"]),
+                returns["last"].tolist(), _as_optional_list(returns["last_close"]), returns["dividends"].tolist(),
+                _as_optional_list(returns["price_return"] * 100), _as_optional_list(returns["total_return"] * 100),
+                _as_optional_list(returns["reinvested_return"] * 100)
             )
-            print(line)
-            
-        print("===================================================================================")
-        
-        generate_yield_chart(summary, year)
-        generate_combined_performance_chart(summary, year)
-        generate_subtracted_performance_chart(summary, year)
-        
-        # --- JSON Output for Web Interface ---
-        import json
-        json_data = []
-        for stock, vals in summary.items():
-            # vals = (total, name, price, price_date, shares, price_change, bought_price, low, high, dividends)
-            total, name, price, p_date, shares, p_change, b_price, low_t, high_t, dividends_list = vals
-            
-            yield_val = 0.0
-            if total > 0 and price is not None and price > 0:
-                yield_val = (total / price) * 100
-
-            total_value = 0.0
-            if price is not None and shares is not None:
-                total_value = price * shares
-
-            net_pl = 0.0
-            percent_pl = 0.0
-            if b_price is not None and price is not None and shares is not None:
-                net_pl = (price - b_price) * shares
-                if b_price > 0:
-                    percent_pl = ((price - b_price) / b_price) * 100
-            
-            signal = ""
-            if b_price is not None and price is not None:
-                current_pl_p = percent_pl
-                if high_t is not None and current_pl_p >= high_t:
-                    signal = "Take-Profit"
-                elif low_t is not None and current_pl_p <= low_t:
-                    signal = "Cut-Loss"
-            
-            s_count = shares if shares else 0
-            # Adjust dividend events to reflect real total profit (Amount * shares)
-            adjusted_events = []
-            for ev in dividends_list:
-                adjusted_events.append({
-                    "Date": ev["Date"],
-                    "Amount": ev["Amount"] * s_count
+            rows = []
+            for stock_code, first, first_close, last, last_close, per_share, price_return, total_return, reinvested_return in columns:
+                rows.append({
+                    "stock": stock_code,
+                    "name": summary[stock_code].name,
+                    "first_date": datetime.date.fromordinal(first).isoformat() if first else None,
+                    "first_close": first_close,
+                    "last_date": datetime.date.fromordinal(last).isoformat() if last else None,
+                    "last_close": last_close,
+                    "dividends": per_share,
+                    "price_return": price_return,
+                    "total_return": total_return,
+                    "reinvested_return": reinvested_return
                 })
 
-            json_data.append({
-                "stock": stock,
-                "name": name,
-                "dividend": total,  # Dividend per share only
-                "yield": yield_val,
-                "price": price if price else 0,
-                "price_date": p_date,
-                "shares": s_count,
-                "total_value": total_value,
-                "net_pl": net_pl,
-                "percent_pl": percent_pl,
-                "signal": signal,
-                "events": adjusted_events
+            portfolio = portfolio_returns(returns, shares)
+            for key in ("price_return", "total_return", "reinvested_return"):
+                if portfolio[key] is not None:
+                    portfolio[key] *= 100
+            computed.append({
+                "period": label, "start": period_start.isoformat(), "end": period_end.isoformat(),
+                "rows": rows, "portfolio": portfolio
             })
-            
-        print("\n---JSON_START---")
-        print(json.dumps(json_data))
-        print("---JSON_END---")
-    # --- End of new summary printing logic ---
+    return computed
+
+# Total return table columns: (key, header, right-aligned)
+TOTAL_RETURN_COLUMNS = [
+    ("stock", "Stock", False), ("name", "Name", False), ("first", "From", False), ("last", "To", False),
+    ("dividends", "Dividends", True), ("price_return", "Price %", True), ("total_return", "Total %", True),
+    ("reinvested_return", "Reinvested %", True)
+]
+
+def render_total_return_report(total_returns, lines):
+    """Appends one table of holding returns per period and the portfolio's returns to lines."""
+    headers = {key: header for key, header, _ in TOTAL_RETURN_COLUMNS}
+    for period in total_returns:
+        rows = period["rows"]
+        lines.append(f"\n=== Total Return ({period['period']}) ===")
+        cells = {
+            "stock": [row["stock"] for row in rows],
+            "name": [row["name"] for row in rows],
+            "first": [_format_trade_day(row["first_date"], row["first_close"]) for row in rows],
+            "last": [_format_trade_day(row["last_date"], row["last_close"]) for row in rows],
+            "dividends": [f"{row['dividends']:.2f}" for row in rows],
+            "price_return": _format_optional([row["price_return"] for row in rows], "{:+.2f}%", "N/A"),
+            "total_return": _format_optional([row["total_return"] for row in rows], "{:+.2f}%", "N/A"),
+            "reinvested_return": _format_optional([row["reinvested_return"] for row in rows], "{:+.2f}%", "N/A")
+        }
+        render_table(TOTAL_RETURN_COLUMNS, headers, cells, lines)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
+        portfolio = period["portfolio"]
+        if portfolio["holdings"]:
+            lines.append(
+                f"Portfolio ({portfolio['holdings']} holdings): Price {portfolio['price_return']:+.2f}%, "
+                f"Total {portfolio['total_return']:+.2f}%, Reinvested {portfolio['reinvested_return']:+.2f}%"
+            )
+        else:
+            lines.append("Portfolio: no holdings with shares and prices in this period.")
+        lines.append("===================================================================================")
+
+def print_total_return_report(total_returns, out=None):
+    """Prints the holding return tables."""
+    lines = []
+    render_total_return_report(total_returns, lines)
+    write_text(lines, out)
+
+# Taiwan Stock Exchange regular session, in Taipei time (UTC+8, no daylight saving)
+MARKET_TIMEZONE = datetime.timezone(datetime.timedelta(hours=8))
+MARKET_OPEN = datetime.time(9, 0)
+MARKET_CLOSE = datetime.time(13, 30)
+
+def is_market_open(now=None):
+    """Returns True on weekdays between the TWSE open and close."""
+    now = now or datetime.datetime.now(MARKET_TIMEZONE)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() <= MARKET_CLOSE
+
+def update_totals(totals, old_row, new_row):
+    """Moves the portfolio totals from one version of a stock's JSON row to another."""
+    totals["dividend_income"] += new_row["dividend"] * new_row["shares"] - old_row["dividend"] * old_row["shares"]
+    totals["total_value"] += new_row["total_value"] - old_row["total_value"]
+    totals["net_pl"] += new_row["net_pl"] - old_row["net_pl"]
+    for key, signal in (("take_profit", "Take-Profit"), ("cut_loss", "Cut-Loss")):
+        totals[key] += (new_row["signal"] == signal) - (old_row["signal"] == signal)
+
+def refresh_prices(result, workers=8, cache=None, log=print, quote_batch=QUOTE_BATCH_SIZE):
+    """
+    Re-polls only the latest price of every stock in a collect_dividends() result.
+    Dividends and price changes are kept; the stocks whose price moved get their records,
+    JSON row and the totals updated in place. Returns the JSON rows of those stocks.
+    The column views in "metrics" and "yearly_metrics" keep the collected prices; rebuild
+    them from the summaries before reporting the result again.
+    A stock listed more than once is summarized by its last position, so only that
+    position's JSON row is updated; extra row fields such as "portfolios" are kept.
+    """
+    summary = result["summary"]
+    stock_codes = list(summary)
+    json_data = result["json_data"]
+    row_index = {row["stock"]: index for index, row in enumerate(json_data)}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        quotes_by_code = fetch_quotes_yahoo(stock_codes, log, quote_batch, executor)
+    quotes = [quotes_by_code[stock_code] for stock_code in stock_codes]
+
+    changed_rows = []
+    for stock_code, quote in zip(stock_codes, quotes):
+        if not quote or quote["price"] is None:
+            continue # Keep the last known price
+        if cache is not None:
+            cache.put(f"quote:{stock_code}", "quote", quote)
+
+        price, price_date = quote_to_price(quote, stock_code, log)
+        record = summary[stock_code]
+        if price == record.price and price_date == record.price_date:
+            continue
+
+        summary[stock_code] = replace(record, price=price, price_date=price_date)
+        yearly_records = {}
+        for year in result["years"]:
+            yearly_summary = result["yearly_summaries"][year]
+            yearly_summary[stock_code] = replace(yearly_summary[stock_code], price=price, price_date=price_date)
+            yearly_records[year] = yearly_summary[stock_code]
+
+        index = row_index[stock_code]
+        row = dict(json_data[index], **build_stock_json_row(stock_code, summary[stock_code], yearly_records, result["year_label"]))
+        update_totals(result["totals"], json_data[index], row)
+        json_data[index] = row
+        changed_rows.append(row)
+    return changed_rows
+
+def build_alert_engine(result, cooldown=300, hysteresis_pct=1.0, emitters=None):
+    """
+    Builds an AlertEngine over the positions of a collect_dividends() result, primed with
+    their current prices. A household result watches each portfolio's own positions.
+    """
+    engine = AlertEngine(cooldown, hysteresis_pct, emitters)
+    portfolios = result.get("portfolios") or [{"name": None, "result": result}]
+    for portfolio in portfolios:
+        for stock_code, record in portfolio["result"]["summary"].items():
+            engine.add_position(
+                stock_code, record.bought_price, record.low_rate_threshold, record.high_rate_threshold,
+                name=record.name, portfolio=portfolio["name"]
+            )
+    for stock_code, record in result["summary"].items():
+        engine.prime(stock_code, record.price)
+    return engine
+
+def watch_prices(result, interval, workers=8, cache=None, log=print, on_rows=None, stop_event=None, market_hours_only=True,
+                 quote_batch=QUOTE_BATCH_SIZE, alerts=None, on_poll=None):
+    """
+    Polls the latest prices of a collect_dividends() result every interval seconds until
+    stop_event is set, passing the rows that changed to on_rows(). Every changed price is
+    also a tick for the `alerts` AlertEngine, if given. Outside the TWSE session no
+    requests are made unless market_hours_only is False. on_poll(polled), if given, is
+    called every interval, also when the poll was skipped (polled is then False).
+    """
+    stop_event = stop_event or threading.Event()
+    while not stop_event.wait(interval):
+        polled = not market_hours_only or is_market_open()
+        if on_poll is not None:
+            on_poll(polled)
+        if not polled:
+            continue
+        changed_rows = refresh_prices(result, workers, cache, log, quote_batch)
+        if changed_rows and on_rows is not None:
+            on_rows(changed_rows)
+        if alerts is not None:
+            for row in changed_rows:
+                alerts.tick(row["stock"], row["price"])
+
+def print_price_updates(rows, out=None):
+    """Prints one line per stock whose price moved during --watch."""
+    now = datetime.datetime.now().strftime('%H:%M:%S')
+    for row in rows:
+        print(
+            f"[{now}] {row['stock']} ({row['name']}) {row['price']:.2f}  "
+            f"P/L {row['net_pl']:,.2f} ({row['percent_pl']:+.2f}%) {row['signal']}".rstrip(),
+            file=out
+        )
+
+def open_cache(args):
+    """Opens the chart cache configured by the command-line options, or None with --no-cache."""
+    if args.no_cache:
+        return None
+    return ChartCache(
+        os.path.join(args.cache_dir, 'yahoo_chart.sqlite3'),
+        max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        ttls={"quote": args.price_ttl},
+        refresh=args.refresh
+    )
+
+def main(args):
+    configure_http_client(
+        pool_size=max(1, args.workers),
+        retries=args.retries,
+        rate_limit=args.rate_limit or None,
+        max_delay=args.max_retry_delay
+    )
+    cache = open_cache(args)
+    # Without --watch nothing revisits the rows, so spool them to disk and keep only compact summaries
+    rows = None if args.watch else RowSpool()
+    try:
+        result = collect(args, cache, rows=rows, compact=not args.watch)
+        if result:
+            print_report(result)
+        if result and args.backtest:
+            print_backtest_report(backtest_portfolio(result, args.workers, cache))
+        if result and args.total_return:
+            periods = total_return_periods(args.year, None if args.total_return is True else args.total_return)
+            print_total_return_report(compute_total_returns(result, periods, args.workers, cache))
+
+        if result and args.watch:
+            emitters = [print_alert]
+            if args.alert_webhook:
+                emitters.append(webhook_emitter(args.alert_webhook))
+            alerts = build_alert_engine(result, args.alert_cooldown, args.alert_hysteresis, emitters)
+            print(f"\nWatching prices every {args.watch:g}s (Ctrl+C to stop)...")
+            watch_prices(
+                result, args.watch, args.workers, cache,
+                on_rows=print_price_updates,
+                market_hours_only=not args.all_hours,
+                quote_batch=args.quote_batch,
+                alerts=alerts
+            )
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        if rows is not None:
+            rows.close()
+        if cache is not None:
+            cache.close()
+
+    if args.profile:
+        # On stderr, so the report and its JSON block stay unchanged
+        print(instrumentation.format_profile(), file=sys.stderr)
+
+def build_arg_parser(parser_class=argparse.ArgumentParser, input_required=True):
+    parser = parser_class(
         description="Fetch stock dividends and get their Chinese names from a local file or an input file.",
         formatter_class=argparse.RawTextHelpFormatter
     )
     parser.add_argument(
         '-y', '--year', 
-        type=int, 
+        type=parse_year_range, 
         required=True,
-        help="The year to fetch dividend data for (e.g., 2023)"
+        help="The year to fetch dividend data for (e.g., 2023),\nor an inclusive range of years (e.g., 2019-2024)"
     )
 
-    group = parser.add_mutually_exclusive_group(required=True)
+    group = parser.add_mutually_exclusive_group(required=input_required)
     group.add_argument(
         '-s', '--stocks', 
         nargs='+', # One or more arguments
@@ -636,9 +1770,123 @@ if __name__ == "__main__":
     )
     group.add_argument(
         '-i', '--input-file', 
+        nargs='+',
+        help="Path to a text file containing stock codes (one per line, or in 'Name StockCode' format).\n"
+             "Several files or a directory of *.txt files give per-portfolio reports and a household view,\n"
+             "fetching every stock only once."
+    )
+    # The web app passes an uploaded portfolio that is already parsed instead of -i or -s
+    parser.set_defaults(portfolio=None)
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=8,
+        help="Number of stocks to fetch concurrently (default: 8, use 1 for sequential fetching)"
+    )
+    parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=10,
+        help="Maximum Yahoo Finance requests per second across all workers (default: 10, 0 for no limit)"
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=3,
+        help="Retries with exponential backoff for throttled (429), 5xx and failed connections (default: 3)"
+    )
+    parser.add_argument(
+        '--max-retry-delay',
+        type=float,
+        default=30,
+        help="Longest wait in seconds before a retry, also when Retry-After asks for more (default: 30)"
+    )
+    parser.add_argument(
+        '--quote-batch',
+        type=int,
+        default=QUOTE_BATCH_SIZE,
+        help=f"Latest prices fetched per batched quote request (default: {QUOTE_BATCH_SIZE},\n1 for one chart request per stock)"
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Always download from Yahoo Finance and do not touch the local cache"
+    )
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help="Ignore cached entries for this run but store the fresh downloads"
+    )
+    parser.add_argument(
+        '--cache-dir',
         type=str,
-        help="Path to a text file containing stock codes (one per line, or in 'Name StockCode' format)."
+        default=DEFAULT_CACHE_DIR,
+        help=f"Directory of the local Yahoo chart cache (default: {DEFAULT_CACHE_DIR})"
     )
-    
-    args = parser.parse_args()
+    parser.add_argument(
+        '--cache-max-mb',
+        type=float,
+        default=64,
+        help="Size bound of the cache and, separately, of its price store; least recently used\nentries are evicted beyond it (default: 64)"
+    )
+    parser.add_argument(
+        '--price-ttl',
+        type=int,
+        default=300,
+        help="Seconds a cached latest price stays fresh (default: 300)"
+    )
+    parser.add_argument(
+        '--watch',
+        type=float,
+        metavar='SECONDS',
+        help="After the report, re-poll only the latest prices every SECONDS\nand print the stocks whose P/L or signal changed"
+    )
+    parser.add_argument(
+        '--all-hours',
+        action='store_true',
+        help="With --watch, keep polling outside TWSE trading hours (09:00-13:30 Taipei time)"
+    )
+    parser.add_argument(
+        '--alert-cooldown',
+        type=float,
+        default=300,
+        help="With --watch, seconds before the same Take-Profit/Cut-Loss alert of a position\ncan repeat (default: 300)"
+    )
+    parser.add_argument(
+        '--alert-hysteresis',
+        type=float,
+        default=1.0,
+        help="With --watch, percent the price must move back past a trigger price\nbefore that alert is armed again (default: 1.0)"
+    )
+    parser.add_argument(
+        '--alert-webhook',
+        type=str,
+        metavar='URL',
+        help="With --watch, also POST every alert as JSON to URL"
+    )
+    parser.add_argument(
+        '--backtest',
+        action='store_true',
+        help="After the report, backtest the Take-Profit/Cut-Loss thresholds over the years:\n"
+             "each year buy at the first close and sell when a threshold is reached or at the last close"
+    )
+    parser.add_argument(
+        '--total-return',
+        nargs='?',
+        const=True,
+        type=parse_date_range,
+        metavar='FROM:TO',
+        help="After the report, print the holding return of every stock and of the portfolio:\n"
+             "price only, with dividends kept and with dividends reinvested on their ex-days.\n"
+             "Per year and for the whole period, or for a date range such as 2023-03-01:2024-02-29"
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help="Print time per stage, HTTP, retry and cache counters to stderr at the end"
+    )
+    return parser
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
     main(args)
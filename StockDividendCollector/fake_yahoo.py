@@ -0,0 +1,215 @@
+"""
+A local stand-in for Yahoo Finance's /v8/finance/chart/ endpoint, for benchmarks.
+It understands range=1d|max and period1/period2 (unix seconds), and answers batched
+quotes on /v7/finance/spark?symbols=A,B,C with one-day charts.
+Serves recorded payloads (<recorded_dir>/<SYMBOL>.json) when present and synthetic
+ones otherwise, with configurable latency, error rate and history length. Spark answers
+can leave out a share of the symbols or fail outright, to exercise the per-symbol fallback.
+Point the collector at it with YAHOO_BASE_URL=http://127.0.0.1:<port>.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+DAY = 86400
+
+def synthetic_chart(symbol, years, params):
+    """Builds a chart result for symbol: daily closes over `years` years and two cash dividends a year."""
+    seed = zlib.crc32(symbol.encode('utf-8'))
+    now = int(time.time())
+    base_price = 20 + seed % 500
+
+    end = now
+    if params.get("period1"):
+        start = int(params["period1"])
+        end = min(now, int(params.get("period2") or now))
+    elif params.get("range") == "1d":
+        start = now - DAY
+    else:
+        start = now - years * 365 * DAY
+    start -= start % DAY
+
+    timestamps, closes = [], []
+    for timestamp in range(start, end, DAY):
+        if datetime.datetime.fromtimestamp(timestamp).weekday() >= 5:
+            continue
+        timestamps.append(timestamp)
+        # Derived from the day, so overlapping requests agree on every close
+        closes.append(round(base_price * (1 + 0.2 * ((timestamp // DAY * 7 + seed) % 100 - 50) / 50), 2))
+
+    # Shaped like Yahoo's answer: the closes come with open/high/low/volume and the adjusted closes
+    result = {
+        "meta": {
+            "symbol": symbol,
+            "currency": "TWD",
+            "regularMarketPrice": closes[-1] if closes else base_price,
+            "regularMarketTime": now,
+            "currentTradingPeriod": {"regular": {"timezone": "CST", "start": now - now % DAY + 3600, "end": now - now % DAY + 19800, "gmtoffset": 28800}},
+            "validRanges": ["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"],
+        },
+        "timestamp": timestamps,
+        "indicators": {
+            "quote": [{
+                "open": [round(close * 0.99, 2) for close in closes],
+                "low": [round(close * 0.98, 2) for close in closes],
+                "volume": [(seed + timestamp // DAY) % 50000 * 1000 for timestamp in timestamps],
+                "close": closes,
+                "high": [round(close * 1.01, 2) for close in closes],
+            }],
+            "adjclose": [{"adjclose": [round(close * 0.97, 4) for close in closes]}],
+        },
+    }
+
+    if "div" in params.get("events", ""):
+        dividends = {}
+        for year in range(datetime.date.fromtimestamp(start).year, datetime.date.today().year + 1):
+            for month in (1, 7):
+                timestamp = int(datetime.datetime(year, month, 15).timestamp())
+                if start <= timestamp <= end:
+                    dividends[str(timestamp)] = {"amount": round(base_price * 0.02, 2), "date": timestamp}
+        result["events"] = {"dividends": dividends}
+
+    return {"chart": {"result": [result], "error": None}}
+
+class FakeYahoo:
+    """Settings and request counters shared by the handler threads."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=429, years=10, recorded_dir=None,
+                 spark_drop_rate=0.0, spark_fail_status=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.years = years
+        self.recorded_dir = recorded_dir
+        self.spark_drop_rate = spark_drop_rate      # Share of symbols left out of spark answers
+        self.spark_fail_status = spark_fail_status  # Answer every spark request with this status
+        self.requests = 0
+        self.errors = 0
+        self.spark_requests = 0
+        self.chart_symbols = [] # Symbol of every chart request, in arrival order
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        # Payloads only depend on the symbol and the query, so render each once
+        self.payload = lru_cache(maxsize=4096)(self._payload)
+
+    def _payload(self, symbol, range_, events, period1=None, period2=None):
+        if self.recorded_dir:
+            path = os.path.join(self.recorded_dir, f"{symbol}.json")
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+        params = {"range": range_, "events": events, "period1": period1, "period2": period2}
+        return json.dumps(synthetic_chart(symbol, self.years, params)).encode('utf-8')
+
+    def drops_from_spark(self, symbol):
+        """Whether spark answers leave symbol out; the same symbols every time."""
+        return zlib.crc32(symbol.encode('utf-8')) % 1000 < self.spark_drop_rate * 1000
+
+    def count_request(self, symbol=None):
+        """Counts a chart request (of symbol) or, without one, a spark request, and decides whether it fails."""
+        with self._lock:
+            self.requests += 1
+            if symbol is None:
+                self.spark_requests += 1
+            else:
+                self.chart_symbols.append(symbol)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "spark_requests": self.spark_requests}
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like the real endpoint
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, content_type='application/json'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                self.send_body(200, json.dumps(fake.stats()).encode('utf-8'))
+                return
+            is_spark = url.path == '/v7/finance/spark'
+            if not is_spark and not url.path.startswith('/v8/finance/chart/'):
+                self.send_body(404, b'{}')
+                return
+
+            if fake.latency:
+                time.sleep(fake.latency)
+            symbol = None if is_spark else url.path.rsplit('/', 1)[-1]
+            if fake.count_request(symbol):
+                self.send_body(fake.error_status, b'{"chart":{"result":null,"error":{"code":"Too Many Requests"}}}')
+                return
+
+            query = parse_qs(url.query)
+            if is_spark:
+                if fake.spark_fail_status:
+                    self.send_body(fake.spark_fail_status, b'{"spark":{"result":null,"error":{"code":"Internal Server Error"}}}')
+                    return
+                symbols = [symbol for symbol in query.get("symbols", [""])[0].split(",") if symbol]
+                results = [
+                    {"symbol": symbol, "response": json.loads(fake.payload(symbol, "1d", ""))["chart"]["result"]}
+                    for symbol in symbols if not fake.drops_from_spark(symbol)
+                ]
+                self.send_body(200, json.dumps({"spark": {"result": results, "error": None}}).encode('utf-8'))
+                return
+
+            body = fake.payload(
+                symbol, query.get("range", ["max"])[0], query.get("events", [""])[0],
+                query.get("period1", [None])[0], query.get("period2", [None])[0]
+            )
+            self.send_body(200, body)
+
+    return Handler
+
+def start_server(port=0, **settings):
+    """Starts the stand-in on a background thread. Returns (server, fake); server.server_port is the port."""
+    fake = FakeYahoo(**settings)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Yahoo Finance chart endpoint.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every chart request (default: 0.05)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of chart requests answered with --error-status")
+    parser.add_argument('--error-status', type=int, default=429)
+    parser.add_argument('--years', type=int, default=10, help="History length of synthetic payloads (default: 10)")
+    parser.add_argument('--recorded-dir', help="Directory with recorded <SYMBOL>.json chart payloads")
+    parser.add_argument('--spark-drop-rate', type=float, default=0.0, help="Fraction of symbols left out of spark answers")
+    parser.add_argument('--spark-fail-status', type=int, help="Answer every spark request with this HTTP status")
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        args.port, latency=args.latency, error_rate=args.error_rate,
+        error_status=args.error_status, years=args.years, recorded_dir=args.recorded_dir,
+        spark_drop_rate=args.spark_drop_rate, spark_fail_status=args.spark_fail_status
+    )
+    print(f"Serving fake Yahoo chart data on http://127.0.0.1:{server.server_port} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
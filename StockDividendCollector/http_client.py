@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+
+# Responses worth another attempt: throttling and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: acquire() blocks until a token is available.
+    Tokens refill at `rate` per second up to `capacity`, which allows short bursts.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class HttpClient:
+    """
+    A connection-pooled HTTP session shared by all fetch threads.
+    Every attempt passes the optional rate limiter; 429/5xx answers and connection
+    errors are retried with exponential backoff (honouring Retry-After). No single wait
+    exceeds max_delay seconds, whatever the server asks for.
+    """
+
+    def __init__(self, pool_size=8, retries=3, backoff=0.5, rate_limit=None, burst=None, timeout=30, max_delay=30):
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "Mozilla/5.0"
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_delay)
+        # Exponential backoff with jitter so concurrent workers do not retry in lockstep
+        return min(self.backoff * (2 ** attempt) * (0.5 + random.random()), self.max_delay)
+
+    def get(self, url, params=None, **kwargs):
+        """Performs a GET with retries. Returns the last response; raises only if no response was received."""
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                started = time.perf_counter()
+                self.limiter.acquire()
+                instrumentation.observe("rate_limit_wait_seconds", time.perf_counter() - started)
+
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                instrumentation.observe("http_request_seconds", time.perf_counter() - started)
+                instrumentation.increment("http_requests_total", status="connection_error")
+                if attempt >= self.retries:
+                    raise
+                instrumentation.increment("http_retries_total", reason="connection_error")
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+
+            instrumentation.observe("http_request_seconds", time.perf_counter() - started)
+            instrumentation.increment("http_requests_total", status=response.status_code)
+            instrumentation.increment("http_response_bytes_total", len(response.content))
+
+            if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                return response
+            instrumentation.increment("http_retries_total", reason=response.status_code)
+            time.sleep(self._retry_delay(attempt, response))
+            attempt += 1
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,131 @@
+"""
+Process-wide counters and stage timings for the collector and the web app.
+Rendered in the Prometheus text format by app.py's /metrics and summarized by
+the CLI's --profile.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = "stock_collector_"
+
+# Shown as # HELP lines; metrics without an entry are still exported
+DESCRIPTIONS = {
+    "http_requests_total": "Yahoo HTTP attempts by response status (connection_error if none)",
+    "http_response_bytes_total": "Bytes received from Yahoo",
+    "http_retries_total": "Yahoo requests retried, by reason",
+    "http_request_seconds": "Time spent in single Yahoo HTTP attempts",
+    "rate_limit_wait_seconds": "Time spent waiting for the request rate limiter",
+    "fetch_errors_total": "Chart fetches that gave up, by HTTP status or error kind",
+    "cache_lookups_total": "Chart cache lookups by result",
+    "quote_batches_total": "Batched (spark) quote requests by result",
+    "price_syncs_total": "Price store downloads, full history or incremental",
+    "symbols_processed_total": "Stocks summarized",
+    "stage_seconds": "Time spent per pipeline stage",
+    "web_runs_total": "/run requests by how they were served",
+    "jobs_waiting": "Runs waiting for a worker",
+    "jobs_in_flight": "Distinct runs queued or running",
+    "result_cache_entries": "Finished results held by the web app",
+    "portfolio_uploads_total": "Uploaded portfolio files, parsed or already known by content",
+    "portfolio_store_entries": "Parsed portfolios held by the web app",
+}
+
+_lock = threading.Lock()
+_counters = {} # (name, labels) -> value
+_timings = {}  # (name, labels) -> [count, total seconds]
+_gauges = {}   # (name, labels) -> value
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def increment(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        timing = _timings.setdefault(key, [0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+@contextmanager
+def timed(stage):
+    """Times a block, or a whole function when used as a decorator, as one call of stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=stage)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+        _gauges.clear()
+
+def snapshot():
+    """Returns plain copies: ({(name, labels): value}, {(name, labels): (count, seconds)}, gauges)."""
+    with _lock:
+        return dict(_counters), {key: tuple(value) for key, value in _timings.items()}, dict(_gauges)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+def render_prometheus():
+    """Renders every metric in the Prometheus text exposition format (version 0.0.4)."""
+    counters, timings, gauges = snapshot()
+    lines = []
+
+    def family(name, kind, samples):
+        full_name = METRIC_PREFIX + name
+        if name in DESCRIPTIONS:
+            lines.append(f"# HELP {full_name} {DESCRIPTIONS[name]}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        lines.extend(samples)
+
+    for name in sorted({name for name, _ in counters}):
+        family(name, "counter", [
+            f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}"
+            for (metric, labels), value in sorted(counters.items()) if metric == name
+        ])
+    for name in sorted({name for name, _ in timings}):
+        samples = []
+        for (metric, labels), (count, seconds) in sorted(timings.items()):
+            if metric == name:
+                samples.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {count}")
+                samples.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {seconds:.6f}")
+        family(name, "summary", samples)
+    for name in sorted({name for name, _ in gauges}):
+        family(name, "gauge", [
+            f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}"
+            for (metric, labels), value in sorted(gauges.items()) if metric == name
+        ])
+    return "\n".join(lines) + "\n"
+
+def format_profile():
+    """A readable summary of the timings and counters, printed by the CLI's --profile."""
+    counters, timings, _ = snapshot()
+    lines = ["", "=== Profile ===", f"{'Timing':<34} {'Calls':>7} {'Total s':>9} {'Avg ms':>9}"]
+    for (name, labels), (count, seconds) in sorted(timings.items()):
+        label = name + _format_labels(labels)
+        lines.append(f"{label:<34} {count:>7} {seconds:>9.3f} {seconds / count * 1000:>9.2f}")
+
+    lines.append("")
+    lines.append(f"{'Counter':<44} {'Value':>12}")
+    for (name, labels), value in sorted(counters.items()):
+        label = name + _format_labels(labels)
+        lines.append(f"{label:<44} {value:>12,}")
+    lines.append("===============")
+    return "\n".join(lines)
@@ -0,0 +1,136 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+class Job:
+    """
+    One queued or running piece of work. Everything it emits is kept, so any number of
+    subscribers can follow it from the start or reconnect at an offset.
+    """
+
+    def __init__(self, key, output_format, format_error, etag=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.etag = etag # Validator of the complete output, known before it is produced
+        self.output_format = output_format
+        self.format_error = format_error
+        self.status = "queued" # queued -> running -> done | failed
+        self.chunks = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def emit(self, chunk):
+        with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    def _set_status(self, status):
+        with self._changed:
+            self.status = status
+            if status in ("done", "failed"):
+                self.finished_at = time.time()
+            self._changed.notify_all()
+
+    def run(self, work):
+        self._set_status("running")
+        try:
+            work(self.emit)
+        except Exception as e:
+            self.emit(self.format_error(e))
+            self._set_status("failed")
+        else:
+            self._set_status("done")
+
+    def follow(self, start=0, on_wait=None):
+        """
+        Yields the emitted chunks from index start on until the job has finished.
+        While nothing new arrives, on_wait() is polled about once a second; whatever
+        it returns (other than None) is yielded, e.g. a queue position update.
+        """
+        index = max(0, start)
+        while True:
+            with self._changed:
+                if index >= len(self.chunks) and not self.finished:
+                    self._changed.wait(timeout=1 if on_wait is not None else None)
+                new_chunks = self.chunks[index:]
+                finished = self.finished # Read with the chunks, so nothing can follow them
+
+            if not new_chunks and not finished and on_wait is not None:
+                note = on_wait()
+                if note:
+                    yield note
+
+            index += len(new_chunks)
+            yield from new_chunks
+            if finished:
+                return
+
+class JobQueue:
+    """
+    Runs jobs on a bounded number of workers. A submission whose key matches a job that
+    is still queued or running joins that job instead of starting another execution.
+    Finished jobs stay available for `retention` seconds so clients can reconnect.
+    """
+
+    def __init__(self, workers=4, retention=300):
+        self.retention = retention
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._lock = threading.Lock()
+        self._jobs = {}      # job id -> Job
+        self._in_flight = {} # dedup key -> queued or running Job
+        self._waiting = []   # queued jobs in submission order
+
+    def submit(self, key, work, output_format, format_error, etag=None):
+        """Returns (job, created). key=None never deduplicates; a joined job keeps its own etag."""
+        with self._lock:
+            self._prune()
+            job = self._in_flight.get(key) if key is not None else None
+            if job is not None:
+                return job, False
+
+            job = Job(key, output_format, format_error, etag)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._in_flight[key] = job
+            self._waiting.append(job)
+
+        self._pool.submit(self._run, job, work)
+        return job, True
+
+    def _run(self, job, work):
+        with self._lock:
+            self._waiting.remove(job)
+        try:
+            job.run(work)
+        finally:
+            with self._lock:
+                if self._in_flight.get(job.key) is job:
+                    del self._in_flight[job.key]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """1-based place of a queued job in line, or 0 once it runs."""
+        with self._lock:
+            try:
+                return self._waiting.index(job) + 1
+            except ValueError:
+                return 0
+
+    def counts(self):
+        """Returns (queued jobs, distinct queued or running executions)."""
+        with self._lock:
+            return len(self._waiting), len(self._in_flight)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,241 @@
+"""
+A local store of daily closing prices, one pair of flat array files per symbol:
+<SYMBOL>.days holds the trading days as int32 proleptic ordinals (date.toordinal())
+and <SYMBOL>.closes the matching float64 closes, both little-endian and sorted by day.
+
+New closes are appended at the end, replacing the last stored day when it is sent
+again (its close may have been an intraday price). Range queries bisect the day
+array, so price changes and first/last closes are answered without the network.
+
+Every write replaces the files through a temporary file and os.replace(), so a reader
+or a concurrent writer never sees a half-written array. Within a process, all writers
+of a directory share one lock; open_price_store() also shares the store itself.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+DAYS_DTYPE = np.dtype('<i4')
+CLOSES_DTYPE = np.dtype('<f8')
+
+def chart_closes(chart):
+    """
+    Reads the daily closes of a chart result as (days, closes) arrays, skipping missing
+    closes. A day that appears twice keeps its last close.
+    """
+    timestamps, close_prices = [], []
+    if chart:
+        timestamps = chart.get('timestamp') or []
+        if 'indicators' in chart:
+            close_prices = chart['indicators']['quote'][0].get('close') or []
+
+    by_day = {}
+    for timestamp, close in zip(timestamps, close_prices):
+        if close is None:
+            continue
+        by_day[datetime.date.fromtimestamp(timestamp).toordinal()] = close
+
+    days = sorted(by_day)
+    return np.array(days, dtype=DAYS_DTYPE), np.array([by_day[day] for day in days], dtype=CLOSES_DTYPE)
+
+def build_history_matrix(histories):
+    """
+    Aligns per-stock histories, a list of (days, closes, dividends) with days as sorted date
+    ordinals and dividends as [(day ordinal, amount)], on the union of their trading days.
+    Returns (days, closes, dividends): the sorted days, the closes matrix and the dividend
+    matrix. A dividend on a day without trading counts on the next trading day.
+    """
+    # Trading days span a few thousand ordinals at most: mark them instead of sorting their union
+    day_arrays = [history[0] for history in histories if len(history[0])]
+    first_day = min((int(stock_days[0]) for stock_days in day_arrays), default=0)
+    last_day = max((int(stock_days[-1]) for stock_days in day_arrays), default=-1)
+    present = np.zeros(last_day - first_day + 1, dtype=bool)
+    for stock_days in day_arrays:
+        present[stock_days - first_day] = True
+    days = (np.flatnonzero(present) + first_day).astype(DAYS_DTYPE)
+    column_of_day = np.cumsum(present) - 1
+
+    closes = np.full((len(histories), len(days)), np.nan)
+    dividends = np.zeros((len(histories), len(days)))
+    for row, (stock_days, stock_closes, stock_dividends) in enumerate(histories):
+        closes[row, column_of_day[stock_days - first_day]] = stock_closes
+        if stock_dividends:
+            dividend_days, amounts = np.array(stock_dividends, dtype=float).T
+            columns = np.searchsorted(days, dividend_days)
+            inside = columns < len(days)
+            np.add.at(dividends[row], columns[inside], amounts[inside])
+    return days, closes, dividends
+
+# Real path of a directory -> its write lock, held by every PriceStore of the directory
+_directory_locks = {}
+_directory_locks_lock = threading.Lock()
+
+def _directory_lock(directory):
+    with _directory_locks_lock:
+        return _directory_locks.setdefault(os.path.realpath(directory), threading.Lock())
+
+# Real path of a directory -> its shared PriceStore
+_stores = {}
+_stores_lock = threading.Lock()
+
+def open_price_store(directory, max_bytes=None):
+    """Returns the process-wide PriceStore of directory; max_bytes, if given, sets its size bound."""
+    key = os.path.realpath(directory)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = PriceStore(directory)
+        if max_bytes is not None:
+            store.max_bytes = max_bytes
+        return store
+
+class PriceStore:
+    """
+    Daily closes per symbol under `directory`, appended incrementally. Beyond max_bytes,
+    the symbols synced least recently are deleted. Open it with open_price_store().
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = _directory_lock(directory)
+        self._size = None # Bytes stored, counted on the first write
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, symbol):
+        name = symbol.replace(os.sep, '_').replace('/', '_')
+        base = os.path.join(self.directory, name)
+        return base + '.days', base + '.closes'
+
+    def _stored_count(self, days_path, closes_path):
+        """Number of complete entries; a write in progress has replaced one file but not yet the other."""
+        try:
+            return min(
+                os.path.getsize(days_path) // DAYS_DTYPE.itemsize,
+                os.path.getsize(closes_path) // CLOSES_DTYPE.itemsize
+            )
+        except OSError:
+            return 0
+
+    def last_day(self, symbol):
+        """The latest stored day as a datetime.date, or None if nothing is stored."""
+        days_path, closes_path = self._paths(symbol)
+        try:
+            with open(days_path, 'rb') as f:
+                # Sized from the open file, which a concurrent os.replace() cannot change
+                count = min(
+                    os.fstat(f.fileno()).st_size // DAYS_DTYPE.itemsize,
+                    os.path.getsize(closes_path) // CLOSES_DTYPE.itemsize
+                )
+                if not count:
+                    return None
+                f.seek((count - 1) * DAYS_DTYPE.itemsize)
+                return datetime.date.fromordinal(int(np.frombuffer(f.read(DAYS_DTYPE.itemsize), dtype=DAYS_DTYPE)[0]))
+        except OSError:
+            return None
+
+    def synced_at(self, symbol):
+        """Unix time of the last append for symbol, or None."""
+        try:
+            return os.path.getmtime(self._paths(symbol)[0])
+        except OSError:
+            return None
+
+    def append(self, symbol, days, closes):
+        """
+        Appends the closes of days from the last stored day on; older days are already
+        stored and are skipped. Returns the number of new days.
+        """
+        days_path, closes_path = self._paths(symbol)
+        with self._lock:
+            count = self._stored_count(days_path, closes_path)
+            last_day = self.last_day(symbol)
+            new_days = len(days)
+            if last_day is not None:
+                last = last_day.toordinal()
+                keep = days >= last
+                days, closes = days[keep], closes[keep]
+                new_days = len(days)
+                if new_days and days[0] == last:
+                    count -= 1 # Replace the last stored close
+                    new_days -= 1
+
+            if len(days):
+                if self._size is None:
+                    self._size = self._stored_bytes()
+                # Closes first: until the days follow, readers see the old count of entries
+                for path, dtype, values in ((closes_path, CLOSES_DTYPE, closes), (days_path, DAYS_DTYPE, days)):
+                    kept = np.fromfile(path, dtype=dtype, count=count) if count else np.empty(0, dtype=dtype)
+                    data = np.concatenate([kept, values.astype(dtype)]).tobytes()
+                    self._size += len(data) - (os.path.getsize(path) if os.path.exists(path) else 0)
+                    self._replace(path, data)
+                if self.max_bytes is not None and self._size > self.max_bytes:
+                    self._evict(symbol)
+            elif last_day is not None:
+                os.utime(days_path) # Nothing new, but the symbol is known to be up to date
+            return new_days
+
+    def _replace(self, path, data):
+        """Writes data to path through a temporary file, so readers see the old or the new file."""
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _stored_bytes(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(('.days', '.closes')))
+
+    def _evict(self, keep):
+        """Deletes the least recently synced symbols, except keep, until the store fits in max_bytes."""
+        keep_path = self._paths(keep)[0]
+        symbols = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.days') and entry.path != keep_path:
+                symbols.append((entry.stat().st_mtime, entry.path[:-len('.days')]))
+        self._size = self._stored_bytes()
+        for _, base in sorted(symbols):
+            if self._size <= self.max_bytes:
+                break
+            for path in (base + '.days', base + '.closes'):
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    self._size -= size
+                except OSError:
+                    pass # Already removed by another process
+
+    def closes(self, symbol, start=None, end=None):
+        """Returns (days, closes) arrays for start <= day <= end (datetime.date, both optional)."""
+        days_path, closes_path = self._paths(symbol)
+        count = self._stored_count(days_path, closes_path)
+        if not count:
+            return np.empty(0, dtype=DAYS_DTYPE), np.empty(0, dtype=CLOSES_DTYPE)
+
+        days = np.fromfile(days_path, dtype=DAYS_DTYPE, count=count)
+        low = 0 if start is None else int(np.searchsorted(days, start.toordinal(), 'left'))
+        high = count if end is None else int(np.searchsorted(days, end.toordinal(), 'right'))
+        closes = np.fromfile(
+            closes_path, dtype=CLOSES_DTYPE, count=max(0, high - low), offset=low * CLOSES_DTYPE.itemsize
+        )
+        return days[low:high], closes
+
+    def first_last_close(self, symbol, start=None, end=None):
+        """Returns (first close, last close, number of closes) within the range, or (None, None, 0)."""
+        _, closes = self.closes(symbol, start, end)
+        if not len(closes):
+            return None, None, 0
+        return float(closes[0]), float(closes[-1]), len(closes)
+
+def is_stale(store, symbol, end, max_age):
+    """Whether symbol needs a sync before answering a query that ends on `end`."""
+    last_day = store.last_day(symbol)
+    if last_day is None:
+        return True
+    if end is not None and end <= last_day:
+        return False # The range is fully stored
+    synced_at = store.synced_at(symbol)
+    return synced_at is None or time.time() - synced_at > max_age
@@ -0,0 +1,317 @@
+"""
+A prebuilt, memory-mapped index of the master stock name table (stock_list.txt).
+
+The text file is compiled once into a binary file of sorted "CODE\\tNAME\\n" records
+plus a table of record offsets. Lookups bisect the offsets and read only the touched
+records, so a run that needs two names does not parse several thousand lines. The
+index is rebuilt whenever the source file's modification time or size changes; each
+version gets its own file, so a mapped index is never overwritten. Where no index can
+be written, the names are parsed into memory instead.
+"""
+
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+MAGIC = b"SNIDX001"
+# magic, source mtime_ns, source size, record count, offset of the records
+HEADER = struct.Struct("<8sqqII")
+OFFSET = struct.Struct("<I")
+
+def parse_stock_list(filepath):
+    """
+    Reads a name file into a dictionary.
+    The file format is expected to be: Chinese Name <whitespace> Stock Code
+    """
+    stock_names = {}
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            # Replace full-width spaces with regular spaces and split
+            parts = line.replace('　', ' ').split()
+            if len(parts) >= 2:
+                stock_code = parts[-1]
+                # The name is everything except the last part
+                chinese_name = ' '.join(parts[:-1]).strip().replace('"', '')
+                stock_names[stock_code] = chinese_name
+    return stock_names
+
+def build_index(source_path, index_path):
+    """Compiles the name file into the binary index at index_path (written atomically)."""
+    stat = os.stat(source_path)
+    records = []
+    for stock_code, name in sorted(parse_stock_list(source_path).items()):
+        # Tabs and newlines delimit records, so they cannot appear inside them
+        clean_code = stock_code.replace('\t', ' ')
+        clean_name = name.replace('\t', ' ').replace('\n', ' ')
+        records.append(f"{clean_code}\t{clean_name}\n".encode('utf-8'))
+
+    offsets = []
+    position = 0
+    for record in records:
+        offsets.append(position)
+        position += len(record)
+
+    records_start = HEADER.size + OFFSET.size * len(records)
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, stat.st_mtime_ns, stat.st_size, len(records), records_start))
+        f.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        f.write(b"".join(records))
+    os.replace(temp_path, index_path)
+
+class StockNameIndex:
+    """
+    Read-only view of a built index. Behaves like a sorted sequence of stock codes for bisect.
+    Once retired, the file is unmapped and lookups are answered by the replacing index.
+    """
+
+    def __init__(self, index_path):
+        self._lock = threading.Lock() # Held by every lookup, so close() never unmaps under a reader
+        self._replacement = None
+        self._file = open(index_path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        try:
+            magic, self.source_mtime_ns, self.source_size, self.count, self._records_start = HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{index_path} is not a stock name index")
+
+    def is_current(self, stat):
+        return self.source_mtime_ns == stat.st_mtime_ns and self.source_size == stat.st_size
+
+    def _record_span(self, index):
+        start = self._records_start + OFFSET.unpack_from(self._map, HEADER.size + OFFSET.size * index)[0]
+        end = self._map.find(b"\n", start)
+        return start, end
+
+    def _record(self, index):
+        start, end = self._record_span(index)
+        code, _, name = self._map[start:end].partition(b"\t")
+        return code, name
+
+    # Sequence protocol over the sorted codes, so bisect can search the mapped file directly
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start, end = self._record_span(index)
+        return self._map[start:self._map.find(b"\t", start, end)]
+
+    def get(self, stock_code, default=None):
+        with self._lock:
+            if self._replacement is None:
+                return self._get(stock_code, default)
+        return self._replacement.get(stock_code, default)
+
+    def search(self, query, limit=20):
+        """
+        Returns [(code, name)] for codes starting with query (case-insensitive, sorted),
+        followed by records whose name contains it.
+        """
+        with self._lock:
+            if self._replacement is None:
+                return self._search(query, limit)
+        return self._replacement.search(query, limit)
+
+    def items(self):
+        """Returns every (code, name) pair, sorted by code."""
+        with self._lock:
+            if self._replacement is None:
+                return [(code.decode('utf-8'), name.decode('utf-8')) for code, name in map(self._record, range(self.count))]
+        return self._replacement.items()
+
+    def retire(self, replacement):
+        """Closes the index once its current lookups finish; later ones go to replacement."""
+        with self._lock:
+            self._replacement = replacement
+        self.close()
+
+    def close(self):
+        """Unmaps the index and closes its file, after any lookup in progress."""
+        with self._lock:
+            self._map.close()
+            self._file.close()
+
+    def _get(self, stock_code, default):
+        key = stock_code.encode('utf-8')
+        index = bisect.bisect_left(self, key)
+        if index < self.count:
+            code, name = self._record(index)
+            if code == key:
+                return name.decode('utf-8')
+        return default
+
+    def _search(self, query, limit):
+        results = []
+        seen = set()
+        prefix = query.upper().encode('utf-8')
+        index = bisect.bisect_left(self, prefix)
+        while index < self.count and len(results) < limit:
+            code, name = self._record(index)
+            if not code.startswith(prefix):
+                break
+            results.append((code.decode('utf-8'), name.decode('utf-8')))
+            seen.add(index)
+            index += 1
+
+        # Name matches: scan the mapped records and map each hit back to its record
+        needle = query.encode('utf-8')
+        position = self._map.find(needle, self._records_start)
+        while position != -1 and len(results) < limit:
+            record_index = bisect.bisect_right(_OffsetView(self), position - self._records_start) - 1
+            if record_index not in seen:
+                seen.add(record_index)
+                code, name = self._record(record_index)
+                if needle in name:
+                    results.append((code.decode('utf-8'), name.decode('utf-8')))
+            _, end = self._record_span(record_index)
+            position = self._map.find(needle, end + 1)
+        return results
+
+class _OffsetView:
+    """The record offsets of an index as a sequence, for bisecting a byte position."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index.count
+
+    def __getitem__(self, position):
+        return OFFSET.unpack_from(self._index._map, HEADER.size + OFFSET.size * position)[0]
+
+class StockNameTable(dict):
+    """The parsed name file in memory, with the lookups of StockNameIndex. Used where no index can be written."""
+
+    def __init__(self, source_path, stat):
+        super().__init__(parse_stock_list(source_path))
+        self.source_mtime_ns = stat.st_mtime_ns
+        self.source_size = stat.st_size
+        self._codes = sorted(self)
+
+    def is_current(self, stat):
+        return self.source_mtime_ns == stat.st_mtime_ns and self.source_size == stat.st_size
+
+    def search(self, query, limit=20):
+        prefix = query.upper()
+        results = [(code, self[code]) for code in self._codes if code.startswith(prefix)][:limit]
+        seen = {code for code, _ in results}
+        for code in self._codes:
+            if len(results) >= limit:
+                break
+            if code not in seen and query in self[code]:
+                results.append((code, self[code]))
+        return results
+
+    def items(self):
+        return [(code, self[code]) for code in self._codes]
+
+    def retire(self, replacement):
+        pass # Nothing is mapped; readers keep a consistent old copy
+
+    def close(self):
+        pass
+
+# source path -> open StockNameIndex (or StockNameTable), reused until the source changes
+_open_indexes = {}
+_open_lock = threading.Lock()
+
+def _index_prefix(source_path):
+    # The path hash keeps same-named files from different directories apart
+    tag = hashlib.sha1(os.path.abspath(source_path).encode('utf-8')).hexdigest()[:10]
+    return f"{os.path.basename(source_path)}.{tag}."
+
+def index_paths(source_path, cache_dir, stat):
+    """
+    Where the index of a name file version may live: the cache directory, else the temp
+    directory. The source's mtime and size are part of the name, so a rebuild writes a new
+    file instead of replacing one that is mapped (which Windows refuses).
+    """
+    name = f"{_index_prefix(source_path)}{stat.st_mtime_ns:x}-{stat.st_size:x}.idx"
+    return [os.path.join(cache_dir, name), os.path.join(tempfile.gettempdir(), name)]
+
+def _remove_stale(source_path, index_path):
+    """Deletes the other index versions of a name file beside index_path, skipping ones still in use."""
+    directory = os.path.dirname(index_path) or '.'
+    prefix = _index_prefix(source_path)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(prefix) and name.endswith('.idx') and name != os.path.basename(index_path):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass # Mapped by another process on Windows; removed on a later rebuild
+
+def _open_current(index_path, stat):
+    try:
+        index = StockNameIndex(index_path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if not index.is_current(stat):
+        index.close()
+        return None
+    return index
+
+def open_name_index(source_path, cache_dir):
+    """
+    Returns the StockNameIndex for a name file, building or rebuilding it when the source
+    changed. If no index can be written, returns a StockNameTable parsed from the file.
+    Returns None if the source file does not exist.
+    """
+    try:
+        stat = os.stat(source_path)
+    except OSError:
+        return None
+
+    with _open_lock:
+        index = _open_indexes.get(source_path)
+        if index is not None and index.is_current(stat):
+            return index
+
+        replaced = _open_indexes.get(source_path)
+        candidates = index_paths(source_path, cache_dir, stat)
+        for index_path in candidates:
+            index = _open_current(index_path, stat)
+            if index is not None:
+                break
+        else:
+            for index_path in candidates:
+                try:
+                    build_index(source_path, index_path)
+                    index = StockNameIndex(index_path)
+                    _remove_stale(source_path, index_path)
+                    break
+                except OSError:
+                    continue # e.g. a read-only cache directory
+            else:
+                try:
+                    index = StockNameTable(source_path, stat)
+                except OSError:
+                    return None
+
+        if replaced is not None:
+            replaced.retire(index)
+        _open_indexes[source_path] = index
+        return index
@@ -0,0 +1,95 @@
+"""
+Holding returns over a date range from daily closes and dividend events, for many stocks at once.
+
+A stock is bought at its first close in the range and held to its last one. Three returns
+are reported, as fractions:
+  price return       last / first - 1
+  total return       dividends are kept as cash: (last + dividends) / first - 1
+  reinvested return  each dividend buys more shares at the close of its ex-day, so the
+                     share count grows by (1 + dividend / close) on every ex-day
+
+The inputs are the aligned matrices of price_store.build_history_matrix(). Dividends and
+the logarithms of the reinvestment factors are summed cumulatively along the days once, so
+the figures of every stock over any range are differences of two columns.
+"""
+
+import numpy as np
+
+def forward_fill(closes):
+    """Replaces every NaN close by the row's last earlier close (NaN before the first one)."""
+    traded = ~np.isnan(closes)
+    columns = np.where(traded, np.arange(closes.shape[1]), 0)
+    np.maximum.accumulate(columns, axis=1, out=columns)
+    filled = closes[np.arange(closes.shape[0])[:, None], columns]
+    filled[~np.maximum.accumulate(traded, axis=1)] = np.nan
+    return filled
+
+class ReturnIndex:
+    """The cumulative dividends and reinvestment factors of aligned histories, reused for every range."""
+
+    def __init__(self, days, closes, dividends):
+        self.days = days
+        self.closes = closes
+        self.traded = ~np.isnan(closes)
+        # A dividend that goes ex on a day without a close of its own is reinvested at the last close
+        with np.errstate(divide='ignore', invalid='ignore'):
+            growth = np.where(dividends > 0, np.log1p(dividends / forward_fill(closes)), 0.0)
+        self.cumulative_dividends = np.cumsum(dividends, axis=1)
+        self.cumulative_growth = np.cumsum(np.nan_to_num(growth), axis=1)
+
+    def holding_returns(self, start, end):
+        """
+        The returns of every row held from its first close on or after start to its last
+        close on or before end (date ordinals, inclusive). Returns a dict of arrays: "first"
+        and "last" (day ordinals, 0 without closes), "first_close", "last_close", "dividends"
+        (per share, ex after the first day up to the last day), "price_return",
+        "total_return" and "reinvested_return" (NaN with fewer than two closes).
+        """
+        count = self.closes.shape[0]
+        low = int(np.searchsorted(self.days, start, 'left'))
+        high = int(np.searchsorted(self.days, end, 'right'))
+        traded = self.traded[:, low:high]
+        has_closes = traded.sum(axis=1) >= 2 if high > low else np.zeros(count, dtype=bool)
+        if not has_closes.any():
+            nan = np.full(count, np.nan)
+            return {
+                "first": np.zeros(count, dtype=int), "last": np.zeros(count, dtype=int),
+                "first_close": nan, "last_close": nan, "dividends": np.zeros(count),
+                "price_return": nan, "total_return": nan, "reinvested_return": nan
+            }
+
+        rows = np.arange(count)
+        first = low + np.argmax(traded, axis=1)
+        last = high - 1 - np.argmax(traded[:, ::-1], axis=1)
+        first_close = np.where(has_closes, self.closes[rows, first], np.nan)
+        last_close = np.where(has_closes, self.closes[rows, last], np.nan)
+        dividends = np.where(has_closes, self.cumulative_dividends[rows, last] - self.cumulative_dividends[rows, first], 0.0)
+        growth = np.exp(self.cumulative_growth[rows, last] - self.cumulative_growth[rows, first])
+
+        return {
+            "first": np.where(has_closes, self.days[first], 0),
+            "last": np.where(has_closes, self.days[last], 0),
+            "first_close": first_close,
+            "last_close": last_close,
+            "dividends": dividends,
+            "price_return": last_close / first_close - 1,
+            "total_return": (last_close + dividends) / first_close - 1,
+            "reinvested_return": last_close * growth / first_close - 1
+        }
+
+def portfolio_returns(returns, shares):
+    """
+    Combines holding_returns() of the rows into the return of holding `shares` of each:
+    the end value over the value at the first closes. Rows without shares or returns are left out.
+    Returns {"price_return", "total_return", "reinvested_return", "holdings"}, the returns None if nothing is held.
+    """
+    held = (shares > 0) & ~np.isnan(returns["price_return"])
+    invested = float(np.sum(shares[held] * returns["first_close"][held]))
+    combined = {"holdings": int(held.sum())}
+    for key in ("price_return", "total_return", "reinvested_return"):
+        if invested > 0:
+            end_value = np.sum(shares[held] * returns["first_close"][held] * (1 + returns[key][held]))
+            combined[key] = float(end_value / invested - 1)
+        else:
+            combined[key] = None
+    return combined